@@ -1,14 +1,33 @@
 from bpy.types import WindowManager
 import bpy.utils.previews
-from bpy.props import PointerProperty, StringProperty, EnumProperty, FloatProperty, BoolProperty
+from bpy.props import PointerProperty, StringProperty, EnumProperty, FloatProperty, BoolProperty, IntProperty, \
+    CollectionProperty
 import bpy
 import os
 import sys
 import re
 import subprocess
+import asyncio
+import collections
+import hashlib
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
 import webbrowser
 
+import numpy as np
+
 from . import addon_updater_ops
+from . import asset_index
+from . import event_loop
+from . import facets
+from . import pixel_store
+from . import scanner
+from . import search
+from . import thumbnails
+from .scanner import is_blend, is_hdr
 
 bl_info = {
     "name": "iMeshh Asset Manager",
@@ -28,8 +47,32 @@ def is_2_80():
     return bpy.app.version >= (2, 80, 0)
 
 def reset_cat(self, context):
+    stop_scan()
     context.scene.asset_manager.cat = 'All'
     context.scene.asset_manager.subcat = '.'
+    context.scene.asset_manager.page = 0
+
+
+# Category and subcategory enum items by (tab, root, category), with the folder mtime and last check time
+folder_items_cache = {}
+
+# Seconds between two checks of the mtime of a cached category folder
+FOLDER_CHECK_INTERVAL = 2.0
+
+# Seconds between two updates of a cached view from the disk
+VIEW_CHECK_INTERVAL = 2.0
+
+# Upper bound of the scan threads preference, the executor of the scan loop never grows past it
+MAX_SCAN_THREADS = 64
+
+def clear_folder_cache(self, context):
+    folder_items_cache.clear()
+
+def reset_shown_page(self, context):
+    context.scene.asset_manager.page = 0
+    pcoll = preview_collections.get("main")
+    if pcoll is not None:
+        pcoll.asset_manager_view = None
 
 
 # Make folders for storing assets
@@ -76,21 +119,66 @@ class KAM_PrefPanel(bpy.types.AddonPreferences):
         name="Assets Path",
         default=os.path.join(os.path.dirname(__file__), 'Assets'),
         description="Show only hotkeys that have this text in their name",
-        subtype="DIR_PATH")
+        subtype="DIR_PATH",
+        update=clear_folder_cache)
     
     material_dir : StringProperty(
         name="Material Path",
         default=os.path.join(os.path.dirname(__file__), 'Assets'),
         description="Show only hotkeys that have this text in their name",
-        subtype="DIR_PATH")
+        subtype="DIR_PATH",
+        update=clear_folder_cache)
     
     hdri_dir : StringProperty(
         name="HDRI Path",
         default=os.path.join(os.path.dirname(__file__), 'Assets'),
         description="Show only hotkeys that have this text in their name",
-        subtype="DIR_PATH")
+        subtype="DIR_PATH",
+        update=clear_folder_cache)
     
 
+    view_cache_size : bpy.props.IntProperty(
+        name="Cached views",
+        description="Number of recently shown categories kept in memory so going back to them doesn't scan again",
+        default=8,
+        min=1,
+        max=64)
+
+    page_size : bpy.props.IntProperty(
+        name="Assets per page",
+        description="Number of assets shown at once, the others are on the next pages. 0 shows all the assets",
+        default=200,
+        min=0,
+        update=reset_shown_page)
+
+    preview_memory_budget : bpy.props.IntProperty(
+        name="Preview memory (MB)",
+        description="Memory the thumbnail previews may use. Past it the least recently shown previews are unloaded,"
+                    " and loaded again from the thumbnail cache when they are shown",
+        default=256,
+        min=16)
+
+    scan_threads : bpy.props.IntProperty(
+        name="Scan threads",
+        description="Number of folders listed at the same time when scanning the library."
+                    " Raise it for libraries on a network share",
+        default=8,
+        min=1,
+        max=MAX_SCAN_THREADS)
+
+    scan_timeout : FloatProperty(
+        name="Scan timeout",
+        description="Seconds to wait for a folder of the library before skipping it and showing what was"
+                    " indexed before, for unresponsive network shares. 0 waits forever",
+        default=10.0,
+        min=0.0)
+
+    use_thumbnail_atlas : BoolProperty(
+        name="Pack previews per category",
+        description="Keep the decoded previews of each category in one memory-mapped atlas file,"
+                    " so a page is filled without opening any thumbnail file",
+        default=False)
+
     switch_corona : BoolProperty(
         name="Enable Corona/Blender switch",
         default=False,
@@ -188,6 +276,15 @@ class KAM_PrefPanel(bpy.types.AddonPreferences):
         col.prop(self, "hdri_dir", text='HDRI path')
         row = layout.row()
         row.prop(self, "switch_corona")
+        row = layout.row()
+        row.prop(self, "view_cache_size")
+        row.prop(self, "page_size")
+        row = layout.row()
+        row.prop(self, "preview_memory_budget")
+        row.prop(self, "use_thumbnail_atlas")
+        row = layout.row()
+        row.prop(self, "scan_threads")
+        row.prop(self, "scan_timeout")
 
         addon_updater_ops.update_settings_ui(self, context)
 
@@ -230,6 +327,8 @@ class KAM_SettingsPanel(bpy.types.Panel):
         col.prop(context.window_manager, 'asset_manager_auto_rename')
         col = layout.column(heading ='Camera Settings')
         col.prop(context.window_manager, 'asset_manager_ignore_camera')
+        col = layout.column(heading ='Material Settings')
+        col.prop(context.window_manager, 'asset_manager_material_assign', text='Assign')
 
 
 # Panel for menu on the right
@@ -252,16 +351,12 @@ class KAM_OpenThumbnail(bpy.types.Operator):
     bl_label = "Thumbnail"
     bl_options = {'REGISTER', 'UNDO'}
 
-    def execute(self, context):
-        selected_blend = context.window_manager.asset_manager_prevs
-        
-        for (blend_path, _, file_blend, icon_id, _) in preview_collections['main'].asset_manager_prevs:
-            #print(blend_path, file_blend, icon_id)
-            if blend_path == selected_blend:
-                for (preview_path, preview_image) in preview_collections['main'].items():
-                    if preview_image.icon_id == icon_id:
-                        webbrowser.open(preview_path)
+    @classmethod
+    def poll(cls, context):
+        return get_selected_record(context) is not None
 
+    def execute(self, context):
+        webbrowser.open(get_selected_record(context).thumb_path)
         return {'FINISHED'}
 
 
@@ -306,6 +401,7 @@ def KAM_UI(self, context):
 
     row = layout.row()
     row.operator("asset_manager.link_to", icon='MESH_UVSPHERE')
+    row.operator("asset_manager.refresh_assets", icon='FILE_REFRESH', text='')
     #TABS
     col = layout.column()
     row = col.split()
@@ -316,12 +412,31 @@ def KAM_UI(self, context):
     col = layout.column()
     col.prop(manager, "cat")
     col.prop(manager, "subcat")
+    col.prop(manager, "search", text='', icon='VIEWZOOM')
+    row = col.row(align=True)
+    row.prop(manager, "filter_type", expand=True)
+    row = col.row(align=True)
+    row.prop(manager, "filter_render", expand=True)
+    row = col.row(align=True)
+    row.prop(manager, "filter_size", expand=True)
+    col.prop(manager, "filter_thumbnail")
     
+    if scan_jobs['current'] is not None or catalog_builds:
+        layout.label(text='Scanning assets...', icon='TIME')
+
     # Thumbnail view
     if len(wm.asset_manager_prevs) != 0:
         row = layout.row()
         row.template_icon_view(wm, "asset_manager_prevs", show_labels=True)
 
+        view = get_current_view()
+        page_count = view.page_count(get_page_size(context)) if view else 1
+        if page_count > 1:
+            row = layout.row(align=True)
+            row.operator("asset_manager.change_page", icon='TRIA_LEFT', text='').step = -1
+            row.label(text='Page %d / %d' % (manager.page + 1, page_count))
+            row.operator("asset_manager.change_page", icon='TRIA_RIGHT', text='').step = 1
+
         row = layout.row(align=True)
         row.operator("asset_manager.open_thumbnail", icon="FILE_IMAGE")
         row.operator("asset_manager.open_blend", icon="FILE_BLEND")
@@ -349,12 +464,31 @@ def KAM_UI(self, context):
             spl = row.split()
             spl.operator("asset_manager.import_object", icon='APPEND_BLEND').link = False
             spl.operator("asset_manager.import_object", icon='LINK_BLEND', text='Link Object').link = True
+            row.operator("asset_manager.queue_asset", icon='ADD')
+            draw_import_queue(layout, manager)
             # selected can be a material but we don't know it
             row = layout.row()
             row.operator("asset_manager.import_material", icon='TEXTURE_DATA')
         
 
 
+def draw_import_queue(layout, manager):
+    """Draw the assets waiting in the import queue, with the buttons importing them"""
+    if not manager.import_queue:
+        return
+    box = layout.box()
+    col = box.column(align=True)
+    for i, item in enumerate(manager.import_queue):
+        row = col.row(align=True)
+        row.label(text=item.name, icon='FILE_BLEND')
+        row.prop(item, 'count', text='')
+        row.operator("asset_manager.unqueue_asset", icon='X', text='').index = i
+    row = box.row(align=True)
+    row.operator("asset_manager.import_queue", icon='APPEND_BLEND').link = False
+    row.operator("asset_manager.import_queue", icon='LINK_BLEND', text='Link Queue').link = True
+    row.operator("asset_manager.clear_queue", icon='TRASH', text='')
+
+
 # Get root directory from user preferences
 def get_root_dir(context=None, true_root=False):
     if not context:
@@ -385,43 +519,66 @@ def get_pref_switch(context=None):
     return pref.switch_corona
 
 def category_items(self, context):
-    categories = []
-    index = 1
     root_dir = get_root_dir(context)
-    if root_dir:
-        for folder in sorted(os.listdir(root_dir)):
-            path = os.path.join(root_dir, folder)
-
-            if os.path.isdir(path) and not folder.startswith('.'):
-                categories.append((folder, folder, '', index))
-                index += 1
-
-        categories.insert(0, ('All', 'All', '', 0))
-    return check_display_folder(categories)
+    if not root_dir:
+        return []
+    return list_folder_items(self.tabs, root_dir, None)
 
 # Fill out sub categories.
 def subcategory_items(self, context):
-    subcategories = [('All', 'All', '', 0)]
-    index = 1
-    root_dir = get_root_dir(context)
-
     if self.cat == 'All':
         return [('.', '.', '', 0)]
     if self.tabs != 'OBJECT':
         return [('0', '.', '', 0)]
-    cat_path = os.path.join(root_dir, self.cat)
-    for folder in sorted(os.listdir(cat_path)):
-        path = os.path.join(cat_path, folder)
-        if os.path.isdir(path) and not folder.startswith('.'):
-            subcategories.append((folder, folder, '', index))
-            index += 1
-    
-    return subcategories
+    return list_folder_items(self.tabs, get_root_dir(context), self.cat)
+
+def list_folder_items(tab, root_dir, category):
+    """
+    Enum items for the folders of the library root or of a category, cached between redraws
+
+    The folder is only listed again when its mtime changed, and its mtime is checked
+    at most every FOLDER_CHECK_INTERVAL seconds so most redraws don't touch the disk.
+
+    :param tab: Selected tab
+    :param root_dir: Path to the root folder of the asset library
+    :param category: Category to list the subcategories of, None to list the categories
+    :return: List of enum items, starting with 'All'
+    """
+    key = (tab, root_dir, category)
+    now = time.monotonic()
+    cached = folder_items_cache.get(key)
+    if cached is not None and now - cached[1] < FOLDER_CHECK_INTERVAL:
+        return cached[2]
+
+    folder = root_dir if category is None else os.path.join(root_dir, category)
+    mtime = scanner.path_mtime(folder)
+    if cached is not None and cached[0] == mtime:
+        folder_items_cache[key] = (mtime, now, cached[2])
+        return cached[2]
+
+    items = [('All', 'All', '', 0)]
+    for entry in scanner.list_dir(folder):
+        if scanner.is_dir(entry) and not entry.name.startswith('.'):
+            items.append((entry.name, entry.name, '', len(items)))
+    if category is None:
+        items = check_display_folder(items)
+
+    folder_items_cache[key] = (mtime, now, items)
+    return items
 
 def subcat_items_none(self, context):
+    stop_scan()
     subcategory_items(self, context)
+    self.page = 0
     return None
 
+def reset_page(self, context):
+    stop_scan()
+    self.page = 0
+
+def reset_filter_page(self, context):
+    self.page = 0
+
 def check_display_folder(categories):
     """
     Remove HDRI and Materials from displayed categories if their folder is inside the main asset folder
@@ -467,8 +624,25 @@ def check_display_folder(categories):
 
 
 
+# Asset waiting in the import queue
+class KAM_ImportQueueItem(bpy.types.PropertyGroup):
+    blend : StringProperty(
+        name="Blend",
+        description="Blend file of the asset",
+        subtype='FILE_PATH')
+
+    count : IntProperty(
+        name="Copies",
+        description="Number of copies of the asset to import",
+        default=1,
+        min=1,
+        max=100)
+
+
 # PropertyGroup for this asset manager
 class KrisAssetManager(bpy.types.PropertyGroup):
+    import_queue : CollectionProperty(type=KAM_ImportQueueItem)
+
     cat : EnumProperty(
         items=category_items,
         name="Category",
@@ -479,7 +653,50 @@ class KrisAssetManager(bpy.types.PropertyGroup):
         items=subcategory_items,
         name="Subcategory",
         description="Select subcategory",
-        update=None)
+        update=reset_page)
+
+    search : StringProperty(
+        name="Search",
+        description="Show the assets of every category whose name contains this text",
+        options={'TEXTEDIT_UPDATE'},
+        update=reset_filter_page)
+
+    filter_type : EnumProperty(
+        items=[('BLEND', 'Blend', 'Assets with a .blend file'),
+               ('HDR', 'HDRI', 'Assets with an HDR file')],
+        name="Type",
+        description="Only show assets of these types",
+        options={'ENUM_FLAG'},
+        update=reset_filter_page)
+
+    filter_render : EnumProperty(
+        items=[('CYCLES', 'Cycles', 'Assets with a Cycles .blend file'),
+               ('CORONA', 'Corona', 'Assets with a Corona .blend file')],
+        name="Render",
+        description="Only show assets with a file for these render engines",
+        options={'ENUM_FLAG'},
+        update=reset_filter_page)
+
+    filter_size : EnumProperty(
+        items=[('SMALL', 'Small', 'Files under 10 MB'),
+               ('MEDIUM', 'Medium', 'Files from 10 to 100 MB'),
+               ('LARGE', 'Large', 'Files over 100 MB')],
+        name="Size",
+        description="Only show assets whose file is in these size ranges",
+        options={'ENUM_FLAG'},
+        update=reset_filter_page)
+
+    filter_thumbnail : BoolProperty(
+        name="Has Thumbnail",
+        description="Only show assets with a thumbnail image",
+        default=False,
+        update=reset_filter_page)
+
+    page : IntProperty(
+        name="Page",
+        description="Page of the assets shown",
+        default=0,
+        min=0)
 
     blend : EnumProperty(
         items=[('cycles', 'Cycles', '', 0), ('corona', 'Corona', '', 1)],
@@ -500,158 +717,900 @@ class KrisAssetManager(bpy.types.PropertyGroup):
 
 # EnumProperty(asset_manager_prevs) Callback
 def scan_directory(self, context):
-    curr_tab = context.scene.asset_manager.tabs
-    root_dir = get_root_dir(context)
-    category = context.scene.asset_manager.cat
-    subcategory = context.scene.asset_manager.subcat
-    if subcategory == '0':
-        directory = os.path.join(root_dir, category)
-    else:
-        directory = os.path.join(root_dir, category, subcategory)
-
-    enum_items = []
     if context is None:
-        return enum_items
+        return []
+
+    manager = context.scene.asset_manager
+    query = ' '.join(manager.search.lower().split())
+    facet_groups = get_facet_groups(manager)
+    if query or facet_groups:
+        # A search looks in every category. Catalog keys are longer than folder view keys
+        # so the two never collide
+        category, subcategory = (None, None) if query else (manager.cat, manager.subcat)
+        view_key = (manager.tabs, get_root_dir(context), category, subcategory, query, facet_groups)
+    else:
+        view_key = (manager.tabs, get_root_dir(context), manager.cat, manager.subcat)
 
     # Get the Preview Collection (defined in register func)
     pcoll = preview_collections["main"]
 
-
-    # Skip if scanned already
-    if directory == pcoll.asset_manager_prev_dir:
+    # Skip if scanned already (or still scanning)
+    if (view_key, manager.page) == pcoll.asset_manager_view:
         return pcoll.asset_manager_prevs
 
-    print("Scanning directory: %s" % directory)
-    if category == 'All' and curr_tab == 'OBJECT':
-        enum_items = scan_for_assets_root(root_dir, enum_items, pcoll)
-    elif category == 'All' and curr_tab == 'HDRI' :
-        enum_items = scan_for_assets_category(root_dir, enum_items, pcoll)
-    elif category == 'All' and curr_tab == 'MATERIAL':
-        enum_items = scan_for_assets_category(root_dir, enum_items, pcoll)
-    elif subcategory == 'All':
-        enum_items = scan_for_assets_category(os.path.join(root_dir, category), enum_items, pcoll)
-    elif directory and os.path.exists(directory):
-        enum_items = scan_for_assets_subcategory(directory, enum_items, pcoll)
+    show_page(context, pcoll, get_view(context, view_key), manager.page)
+    return pcoll.asset_manager_prevs
 
 
-    # Return validation
-    empty_path = os.path.join(os.path.dirname(root_dir), "empty.png")
-    if len(enum_items) == 0:
-        if 'empty' in pcoll:
-            enum_items.append(('empty', '', "", pcoll['empty'].icon_id, 0))
+def get_facet_groups(manager):
+    """Facet filters selected in the panel, as a tuple of groups of facet names, see FacetIndex.match()"""
+    groups = [tuple(sorted(manager.filter_type)), tuple(sorted(manager.filter_render)),
+              tuple(sorted(manager.filter_size)), ('THUMBNAIL',) if manager.filter_thumbnail else ()]
+    return tuple(group for group in groups if group)
+
+
+def get_view(context, view_key):
+    """
+    Get the AssetView of a (tab, root, category, subcategory), from the view cache if it
+    was shown recently, otherwise starting the scan that streams its assets in
+
+    A cached view is shown as it is, and updated in the background from the folders
+    whose mtime moved since it was scanned.
+    """
+    if len(view_key) > 4:
+        return catalog_view(view_key)
+
+    view = view_cache.get(view_key)
+    if view is not None:
+        view_cache.move_to_end(view_key)
+        job = scan_jobs['current']
+        if job is not None and job.view is not view:
+            stop_scan()
+            job = None
+        if job is None and view.complete and time.monotonic() - view.checked > VIEW_CHECK_INTERVAL:
+            folder = get_view_folder(*view_key)
+            if folder is not None:
+                start_scan(ScanJob(view, view_key[0], view_key[1], *folder, refresh=True))
+        return view
+
+    stop_scan()
+    view = AssetView(view_key)
+    cache_view(context, view)
+    folder = get_view_folder(*view_key)
+    if folder is None:
+        view.complete = True
+    else:
+        start_scan(ScanJob(view, view_key[0], view_key[1], *folder))
+    return view
+
+
+def catalog_view(view_key):
+    """
+    Make the AssetView of a search and/or facet filters from the catalog of the indexed assets
+
+    :param view_key: (tab, root, category, subcategory, query, facet groups) tuple, category
+        is None to look in every category
+    """
+    if catalog_views['current'] is not None and catalog_views['current'].key == view_key:
+        return catalog_views['current']
+    tab, root_dir, category, subcategory, query, facet_groups = view_key
+    view = AssetView(view_key)
+    view.complete = True
+    if root_dir and os.path.isdir(root_dir):
+        folder_view = None
+        if category is None:
+            update_catalog(view)
         else:
-            empty = pcoll.load('empty', empty_path, 'IMAGE')
-            enum_items.append(('empty', '', '', empty.icon_id, 0))
+            # The folder view of the category is still scanned (or refreshed) as usual,
+            # the catalog view is made again if that changes the index
+            folder_view = get_view(bpy.context, (tab, root_dir, category, subcategory))
+        catalog = get_catalog(tab, root_dir)
+        if catalog is None:
+            # Made again once the catalog is built, until then the first pages are
+            # filtered out of the index
+            view.complete = False
+            view.add(stream_catalog_view(view_key))
+            catalog_views['current'] = view
+            return view
+        job = scan_jobs['current']
+        if folder_view is not None and job is not None and job.view is folder_view:
+            view.complete = False
+            job.waiting = view
+        names, facet_index, records = catalog
+        bits = facet_index.match(facet_groups)
+        if category not in (None, 'All'):
+            bits &= facet_index.category(category, None if subcategory in ('All', '.', '0') else subcategory)
+        if query:
+            bits &= facets.bits_of(names.search(query))
+        view.add(records[i] for i in facets.ids_of(bits))
+    catalog_views['current'] = view
+    return view
+
+
+# Index rows looked at for the first pages of a search or filter view while its catalog is built
+STREAM_ROWS = 5000
+
+
+def stream_catalog_view(view_key):
+    """
+    Records of the first pages of a search or filter view, filtered out of the asset index
 
-    pcoll.asset_manager_prevs = enum_items
-    pcoll.asset_manager_prev_dir = directory
+    The filters are stacked on the stream of index rows, which stops as soon as the pages
+    shown and the next one are full (or after STREAM_ROWS rows), so nothing waits for the
+    whole library. The records come in the order of the catalog, so they keep their place
+    in the view made from the catalog later.
+    """
+    tab, root_dir, category, subcategory, query, facet_groups = view_key
+    records = itertools.islice(get_asset_index(root_dir).iter_query(tab, root_dir), STREAM_ROWS)
+    if category not in (None, 'All'):
+        records = facets.filter_category(records, category,
+                                         None if subcategory in ('All', '.', '0') else subcategory)
+    records = facets.filter_facets(records, facet_groups)
+    if query:
+        records = search.filter_name(records, query,
+                                     lambda record: (record.name, os.path.basename(record.file_path)))
+    page_size = get_page_size()
+    if page_size <= 0:
+        return records
+    return itertools.islice(records, page_size * (bpy.context.scene.asset_manager.page + 2))
+
+
+def update_catalog(view):
+    """
+    Index the whole tab for a search view, unless it was indexed to the end already
 
+    The view is made again from the catalog when the update brought in new assets.
+    """
+    tab, root_dir = view.key[:2]
+    directory, depth = get_view_folder(tab, root_dir, 'All', 'All')
+    if get_asset_index(root_dir).is_indexed(tab, directory):
+        return
+    view.complete = False
+    job = scan_jobs['current']
+    if job is not None and job.catalog and (job.tab, job.root_dir) == (tab, root_dir):
+        # Already indexing the tab for the previous search
+        job.view = view
+    else:
+        start_scan(ScanJob(view, tab, root_dir, directory, depth))
+
+
+def drop_catalog(tab, root_dir):
+    """
+    Build the catalog of a library again after its index changed, if it is used
+
+    The previous catalog keeps being searched until the new one is ready, the search
+    or filter view shown is then made again.
+    """
+    key = (tab, os.path.normpath(root_dir))
+    if key in catalogs or key in catalog_builds:
+        build_catalog(tab, root_dir)
+
+
+def reset_catalog_view(tab, root_dir):
+    """Make the search or filter view shown for a library again on the next redraw"""
+    view = catalog_views['current']
+    if view is None or view.key[0] != tab or os.path.normpath(view.key[1]) != os.path.normpath(root_dir):
+        return
+    catalog_views['current'] = None
+    pcoll = preview_collections.get("main")
+    if pcoll is not None and pcoll.asset_manager_view is not None and pcoll.asset_manager_view[0] == view.key:
+        pcoll.asset_manager_view = None
+    tag_redraw()
+
+
+def get_catalog(tab, root_dir):
+    """
+    Get the name and facet indexes of the indexed assets of a library, starting their build on first use
+
+    :return: (NameIndex, FacetIndex, records) tuple, asset ids of both indexes are positions in records.
+        None until the first build is done
+    """
+    key = (tab, os.path.normpath(root_dir))
+    if key not in catalogs and key not in catalog_builds:
+        build_catalog(tab, root_dir)
+    return catalogs.get(key)
+
+
+def build_catalog(tab, root_dir):
+    """
+    Build the catalog of a library on the executor of the scan loop, so a large library
+    doesn't freeze the panel. A build started since for the same library supersedes it
+    """
+    key = (tab, os.path.normpath(root_dir))
+    index = get_asset_index(root_dir)
+    catalog_builds[key] = get_scan_loop().create_task(run_catalog_build(key, index, tab, root_dir))
+
+
+async def run_catalog_build(key, index, tab, root_dir):
+    try:
+        catalog = await asyncio.get_running_loop().run_in_executor(None, make_catalog, index, tab, root_dir)
+    except Exception as e:
+        print("Could not build the catalog of %s: %r" % (root_dir, e))
+        catalog = None
+    if catalog_builds.get(key) is not asyncio.current_task():
+        return
+    del catalog_builds[key]
+    if catalog is not None:
+        catalogs[key] = catalog
+        reset_catalog_view(tab, root_dir)
+
+
+def make_catalog(index, tab, root_dir):
+    """Read the records of a library from its index and build its name and facet indexes, see get_catalog()"""
+    names = search.NameIndex()
+    records = list(index.iter_query(tab, root_dir))
+    for record in records:
+        names.add(record.name, os.path.basename(record.file_path))
+    return names, facets.FacetIndex(records), records
+
+
+def show_page(context, pcoll, view, page):
+    """Make the enum items of a page of a view, the assets still being scanned are added as they arrive"""
+    pcoll.asset_manager_view = (view.key, page)
+    pcoll.asset_manager_prevs = []
+    pcoll.asset_manager_pending = {}
+    pcoll.asset_manager_page_thumbs = set()
+    preview_queue.clear()
+    fill_page(pcoll, view, get_page_size(context))
+    queue_neighbour_previews(pcoll, view, get_page_size(context))
+    evict_previews(pcoll, context)
     bpy.data.window_managers[0]['asset_manager_prevs'] = 0
 
-    return enum_items
 
+class AssetView:
+    """
+    Asset records shown for one (tab, root, category, subcategory), filled while it is scanned,
+    with the records by the identifier of their enum item
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.records = []
+        self.by_identifier = {}
+        self.complete = False
+        # time.monotonic() of the last time the view was brought up to date
+        self.checked = 0.0
+
+    def add(self, records):
+        """Add the records of an iterable, which is consumed once"""
+        for record in records:
+            self.records.append(record)
+            self.by_identifier[record.file_path] = record
+
+    def replace(self, records):
+        """
+        Replace the records of the view by those of a list
+
+        :return: True if the assets or their mtimes changed
+        """
+        if [(r.path, r.mtime) for r in records] == [(r.path, r.mtime) for r in self.records]:
+            return False
+        self.records = []
+        self.by_identifier = {}
+        self.add(records)
+        return True
+
+    def page_count(self, page_size):
+        if page_size <= 0:
+            return 1
+        return max(1, -(-len(self.records) // page_size))
+
+
+def cache_view(context, view):
+    """Remember the assets of a view, forgetting the least recently shown views past the cache size"""
+    size = context.preferences.addons[__name__].preferences.view_cache_size
+    view_cache[view.key] = view
+    view_cache.move_to_end(view.key)
+    while len(view_cache) > size:
+        view_cache.popitem(last=False)
+
+
+def get_page_size(context=None):
+    if not context:
+        context = bpy.context
+    return context.preferences.addons[__name__].preferences.page_size
+
+
+def get_current_view():
+    """The AssetView shown in the panel, or None"""
+    pcoll = preview_collections.get("main")
+    if pcoll is None or pcoll.asset_manager_view is None:
+        return None
+    key = pcoll.asset_manager_view[0]
+    if catalog_views['current'] is not None and catalog_views['current'].key == key:
+        return catalog_views['current']
+    return view_cache.get(key)
 
-def is_hdr(file):
-    return file.lower().endswith(('.hdr', '.hdri', '.exr'))
 
+def fill_page(pcoll, view, page_size):
+    """
+    Add the assets of the shown page that aren't in pcoll.asset_manager_prevs yet
 
-def is_blend(file):
-    return file.lower().endswith(('.blend',))
+    Only the items of the shown page are ever created. Previews found in the atlas of
+    their category are created right away, the other items get a placeholder icon
+    and their thumbnail is queued for the preview loader.
 
+    :param pcoll: Preview collection
+    :param view: AssetView shown in the panel
+    :param page_size: Number of assets per page, 0 to show all the assets on one page
+    :return: Number of items added
+    """
+    enum_items = pcoll.asset_manager_prevs
+    if enum_items and enum_items[0][0] == 'empty':
+        return 0
+
+    page = pcoll.asset_manager_view[1]
+    start = page * page_size
+    stop = start + page_size if page_size > 0 else len(view.records)
+    records = view.records[start + len(enum_items):stop]
+    use_atlas = bpy.context.preferences.addons[__name__].preferences.use_thumbnail_atlas
+    for record in records:
+        thumb_path = record.thumb_path
+        pcoll.asset_manager_page_thumbs.add(thumb_path)
+        if thumb_path in pcoll:
+            icon_id = pcoll[thumb_path].icon_id
+            preview_usage.touch(thumb_path)
+        elif use_atlas and atlas_preview(pcoll, view.key[1], record) is not None:
+            icon_id = pcoll[thumb_path].icon_id
+        else:
+            icon_id = get_placeholder_icon()
+            pcoll.asset_manager_pending.setdefault(thumb_path, []).append(len(enum_items))
+            queue_preview(thumb_path, 0, record)
+        enum_items.append(enum_item_from_record(record, icon_id, len(enum_items)))
 
-def is_image(file):
-    return file.lower().endswith(('.png', '.jpg'))
+    if view.complete and not enum_items:
+        add_empty_item(enum_items, pcoll, view.key[1])
+    return len(records)
 
 
-def find_blend_in_path(path):
-    file_name = "no blend"
-    for file in os.listdir(path):
-        if is_blend(file):
-            file_name = file
+def queue_neighbour_previews(pcoll, view, page_size):
+    """Queue the thumbnails of the pages around the shown one, after those of the shown page"""
+    if page_size <= 0:
+        return
+    page = pcoll.asset_manager_view[1]
+    for neighbour in (page + 1, page - 1):
+        if neighbour < 0:
+            continue
+        for record in view.records[neighbour * page_size:(neighbour + 1) * page_size]:
+            thumb_path = record.thumb_path
+            if thumb_path not in pcoll:
+                queue_preview(thumb_path, 1, record)
+
+
+class PreviewQueue:
+    """
+    Thumbnails waiting to be loaded, by priority (0 for the shown page, then the neighbouring pages)
+    and in the order they were queued, with the record of their asset
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._queued = set()
+        self._records = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def clear(self):
+        self._heap.clear()
+        self._queued.clear()
+        self._records.clear()
+
+    def push(self, path, priority, record=None):
+        if record is not None:
+            self._records[path] = record
+        if path not in self._queued:
+            self._queued.add(path)
+            heapq.heappush(self._heap, (priority, next(self._counter), path))
+
+    def pop(self):
+        """Remove and return the most urgent path and its record as a tuple, (None, None) if the queue is empty"""
+        if not self._heap:
+            return None, None
+        path = heapq.heappop(self._heap)[2]
+        self._queued.discard(path)
+        return path, self._records.get(path)
+
+
+preview_queue = PreviewQueue()
+
+# Seconds spent loading previews per timer step
+PREVIEW_TIME_BUDGET = 0.03
+
+# Seconds between two writes of the pixel store indexes while previews are being loaded
+PIXEL_STORE_FLUSH_INTERVAL = 5.0
+
+
+def queue_preview(path, priority, record=None):
+    preview_queue.push(path, priority, record)
+    if not bpy.app.timers.is_registered(process_preview_queue):
+        bpy.app.timers.register(process_preview_queue, first_interval=0.01, persistent=True)
+
+
+def process_preview_queue():
+    """
+    Timer callback loading queued thumbnails and swapping them in for the placeholder icons
+
+    :return: Delay before the next call, None once the queue is empty and no thumbnail is being downscaled
+    """
+    pcoll = preview_collections.get("main")
+    if pcoll is None:
+        return None
+
+    enum_items = pcoll.asset_manager_prevs
+    pending = pcoll.asset_manager_pending
+    thumbnail_cache = get_thumbnail_cache()
+    view = get_current_view()
+    root_dir = view.key[1] if view is not None else ''
+
+    # Thumbnails downscaled in the background since the last step can be loaded now
+    for path in thumbnail_cache.take_finished():
+        preview_queue.push(path, 0 if path in pending else 1)
+
+    loaded = 0
+    start = time.monotonic()
+    while time.monotonic() - start < PREVIEW_TIME_BUDGET:
+        path, record = preview_queue.pop()
+        if path is None:
             break
-        elif is_hdr(file) and file_name == 'no blend':
-            file_name = file
-    return file_name
+        store, key = get_preview_store(root_dir, record) if root_dir else (None, None)
+        icon_id = load_preview(path, pcoll, store, key)
+        if icon_id is None:
+            continue
+        for i in pending.pop(path, ()):
+            enum_items[i] = enum_items[i][:3] + (icon_id, i)
+        loaded += 1
+
+    if loaded:
+        evict_previews(pcoll)
+        tag_redraw()
+    busy = len(preview_queue) or thumbnail_cache.busy
+    # Writing an index rewrites it whole, so it waits for the loader to be done (or for a pause)
+    if not busy or time.monotonic() - pixel_store_flushes['time'] > PIXEL_STORE_FLUSH_INTERVAL:
+        flush_pixel_stores()
+    if len(preview_queue):
+        return 0.02
+    return 0.1 if thumbnail_cache.busy else None
+
+
+# time.monotonic() of the last write of the pixel store indexes
+pixel_store_flushes = {'time': 0.0}
+
+def flush_pixel_stores():
+    for store in pixel_stores.values():
+        store.flush()
+    pixel_store_flushes['time'] = time.monotonic()
+
+
+class PreviewUsage:
+    """
+    Estimated memory held by the previews of the preview collection, least recently shown first
+    """
 
+    # Estimated size of the icon Blender keeps next to each preview image (32x32 RGBA)
+    ICON_BYTES = 32 * 32 * 4
+
+    def __init__(self):
+        self._sizes = collections.OrderedDict()
+        self.total = 0
+
+    def add(self, path, preview):
+        width, height = preview.image_size
+        size = width * height * 4 + self.ICON_BYTES
+        self.total += size - self._sizes.get(path, 0)
+        self._sizes[path] = size
+        self._sizes.move_to_end(path)
+
+    def touch(self, path):
+        if path in self._sizes:
+            self._sizes.move_to_end(path)
+
+    def evict(self, pcoll, budget, keep):
+        """
+        Remove the least recently shown previews from pcoll until the estimate fits in budget
+
+        :param pcoll: Preview collection
+        :param budget: Memory budget in bytes
+        :param keep: Paths of the previews that must stay loaded
+        :return: Number of previews removed
+        """
+        removed = 0
+        for path in list(self._sizes):
+            if self.total <= budget:
+                break
+            if path in keep:
+                continue
+            self.total -= self._sizes.pop(path)
+            if path in pcoll:
+                del pcoll[path]
+            removed += 1
+        return removed
 
-def load_preview(img_path, pcoll):
-    if img_path in pcoll:
-        return pcoll[img_path].icon_id
+    def clear(self):
+        self._sizes.clear()
+        self.total = 0
+
+
+preview_usage = PreviewUsage()
+
+
+def evict_previews(pcoll, context=None):
+    """Keep the previews within the memory budget, the previews of the shown page are never removed"""
+    if not context:
+        context = bpy.context
+    budget = context.preferences.addons[__name__].preferences.preview_memory_budget * 1024 * 1024
+    preview_usage.evict(pcoll, budget, pcoll.asset_manager_page_thumbs)
+
+
+def get_placeholder_icon():
+    """Icon shown in the grid until the thumbnail of an asset is loaded"""
+    return bpy.types.UILayout.bl_rna.functions['prop'].parameters['icon'].enum_items['TIME'].value
+
+
+def get_view_folder(curr_tab, root_dir, category, subcategory):
+    """
+    Find the folder to scan for the selected category and subcategory
+
+    :param curr_tab: Selected tab
+    :param root_dir: Path to the root folder of the asset library
+    :param category: Selected category
+    :param subcategory: Selected subcategory ('0' for libraries without subcategories)
+    :return: (directory, depth) tuple where depth is the number of folder levels between
+        directory and the asset folders, or None if there is nothing to scan
+    """
+    if not root_dir or not os.path.isdir(root_dir):
+        return None
+
+    if category == 'All':
+        return root_dir, 2 if curr_tab == 'OBJECT' else 1
+    elif subcategory == 'All':
+        return os.path.join(root_dir, category), 1
+    elif subcategory == '0':
+        return os.path.join(root_dir, category), 0
+    return os.path.join(root_dir, category, subcategory), 0
+
+
+def add_empty_item(enum_items, pcoll, root_dir):
+    """Show the 'empty' preview when a view has no assets"""
+    empty_path = os.path.join(os.path.dirname(root_dir), "empty.png")
+    if 'empty' in pcoll:
+        enum_items.append(('empty', '', "", pcoll['empty'].icon_id, 0))
     else:
-        thumb = pcoll.load(img_path, img_path, 'IMAGE')
-        return thumb.icon_id
+        empty = pcoll.load('empty', empty_path, 'IMAGE')
+        enum_items.append(('empty', '', '', empty.icon_id, 0))
 
 
-def scan_for_assets_subcategory(directory, enum_items, pcoll):
+class ScanJob:
     """
-    Scan for assets inside a sub category
+    Bring the asset index up to date for one view, as a task of the scan event loop
 
-    :param directory: The path to the sub-category
-    :param enum_items: List of all enum items already scanned (will be mutated and returned)
-    :param pcoll: Preview collection
-    :return: Original enum_items parameter with the items from this sub-category added
+    The filesystem is only touched from the executor of the loop. The task itself
+    runs on the main thread, so the assets of each folder are added to the view and
+    shown as soon as the folder is up to date.
+
+    A refresh job updates a view that is shown already: the assets are collected
+    and only replace those of the view once the update is done, if they changed.
+    The view of a catalog job (a search or filter view) is made again from the
+    catalog once the update is done, if the index changed.
     """
-    if os.path.isdir(directory):
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
-            
-
-            # Handle loose .hdr file
-            if is_hdr(item):
-                icon_id = load_preview(item_path, pcoll)
-                enum_items.append((item_path, item, item, icon_id, len(enum_items)))
-                continue
 
-            #Check validity of item_path
-            if os.path.isdir(item_path):
-                # The item is a folder that contains either a blend file or an HDRI file
-                file_blend = find_blend_in_path(item_path)
-                # Find the preview and load it
-                for file in os.listdir(item_path):
-                    if is_image(file):
-                        img_path = os.path.join(item_path, file)
-                        blend_path = os.path.join(item_path, file_blend)
-                        icon_id = load_preview(img_path, pcoll)
-                        enum_items.append((blend_path, item, file_blend, icon_id, len(enum_items)))
-                        break
-                else:
-                    # No preview found, if it's an HDRI than load that as the preview
-                    if is_hdr(file_blend):
-                        img_path = os.path.join(item_path, file_blend)
-                        icon_id = load_preview(img_path, pcoll)
-                        enum_items.append((img_path, item, file_blend, icon_id, len(enum_items)))
-
-    return enum_items
-
-
-def scan_for_assets_category(directory, enum_items, pcoll):
+    def __init__(self, view, tab, root_dir, directory, depth, refresh=False):
+        self.view = view
+        self.refresh = refresh
+        self.catalog = len(view.key) > 4
+        # Catalog view shown from the index while this job updates it
+        self.waiting = None
+        self.found = []
+        self.tab = tab
+        self.root_dir = root_dir
+        self.directory = directory
+        self.depth = depth
+        prefs = bpy.context.preferences.addons[__name__].preferences
+        self.workers = prefs.scan_threads
+        self.timeout = prefs.scan_timeout or None
+        self.index = get_asset_index(root_dir)
+        self.task = None
+        self.cancelled = threading.Event()
+
+    def start(self):
+        self.task = get_scan_loop().create_task(self.run())
+
+    def cancel(self):
+        """Abort the scan, including the folders being listed in the executor"""
+        self.cancelled.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        scanner.syscalls.reset()
+        try:
+            changed = await self.index.update_async(self.tab, self.root_dir, self.directory, self.depth,
+                                                    self.add_container, self.workers, self.timeout,
+                                                    self.cancelled)
+            print("Updated asset index for %s (%r)" % (self.directory, scanner.syscalls))
+            if changed:
+                # The assets found are searched and filtered from now on
+                drop_catalog(self.tab, self.root_dir)
+        except (asyncio.CancelledError, scanner.ScanCancelled):
+            raise
+        except Exception as e:
+            # The task is the last place the error can be caught (a locked index on a share...)
+            print("Could not update the asset index for %s: %r" % (self.directory, e))
+            self.fail()
+            return
+        finally:
+            if scan_jobs['current'] is self:
+                scan_jobs['current'] = None
+        if self.waiting is not None and not changed:
+            # The catalog view was up to date already
+            self.waiting.complete = True
+            self.show(self.waiting)
+        self.view.checked = time.monotonic()
+        if self.refresh:
+            if self.view.replace(self.found):
+                pcoll = preview_collections.get("main")
+                if pcoll is not None and get_current_view() is self.view:
+                    show_page(bpy.context, pcoll, self.view, pcoll.asset_manager_view[1])
+                tag_redraw()
+            return
+        self.view.complete = True
+        self.show(self.view, done=True)
+
+    def fail(self):
+        """Show what was found before an error, the view is scanned again the next time it is selected"""
+        if not self.refresh and view_cache.get(self.view.key) is self.view:
+            del view_cache[self.view.key]
+        for view in (self.view, self.waiting):
+            if view is not None and not view.complete:
+                view.complete = True
+                self.show(view, done=True)
+        tag_redraw()
+
+    def add_container(self, container):
+        if self.catalog:
+            return
+        records = self.index.iter_container(self.tab, self.root_dir, container)
+        if self.refresh:
+            self.found.extend(records)
+            return
+        self.view.add(records)
+        self.show(self.view)
+
+    @staticmethod
+    def show(view, done=False):
+        """Show the assets of view found so far if they land on the shown page"""
+        pcoll = preview_collections.get("main")
+        if pcoll is not None and get_current_view() is view:
+            fill_page(pcoll, view, get_page_size())
+            if done:
+                queue_neighbour_previews(pcoll, view, get_page_size())
+        tag_redraw()
+
+
+# Running scan, its results are shown as they arrive
+scan_jobs = {'current': None}
+
+# Event loop the scans run on, created on first use
+scan_loops = {}
+
+def get_scan_loop():
+    if scan_loops.get('main') is None:
+        scan_loops['main'] = event_loop.SteppedLoop(MAX_SCAN_THREADS)
+    if not bpy.app.timers.is_registered(process_scan_loop):
+        bpy.app.timers.register(process_scan_loop, first_interval=0.01, persistent=True)
+    return scan_loops['main']
+
+
+def start_scan(job):
+    stop_scan()
+    scan_jobs['current'] = job
+    job.start()
+
+
+def stop_scan():
     """
-    Scan for all assets inside a category
+    Cancel the running scan, its partial view is dropped from the view cache
 
-    :param directory: The path to the category
-    :param enum_items: List of all enum items already scanned (will be mutated and returned)
-    :param pcoll: Preview collection
-    :return: Original enum_items parameter with the items from this category added
+    What the scan already brought up to date stays in the asset index, so scanning
+    the view again only lists the folders it didn't get to.
     """
-    if os.path.isdir(directory):
-        for subcategory in os.listdir(directory):
-            scan_for_assets_subcategory(os.path.join(directory, subcategory), enum_items, pcoll)
-    return enum_items
+    job = scan_jobs['current']
+    if job is not None:
+        scan_jobs['current'] = None
+        job.cancel()
+        if not job.refresh and view_cache.get(job.view.key) is job.view:
+            del view_cache[job.view.key]
 
 
-def scan_for_assets_root(root, enum_items, pcoll):
+def process_scan_loop():
     """
-    Scan for all assets in the asset library
+    Timer callback stepping the scan event loop
 
-    :param root: Path to the root folder of the asset library
-    :param enum_items: List of all enum items already scanned (will be mutated and returned)
+    :return: Delay before the next call, None once no task is left
+    """
+    loop = scan_loops.get('main')
+    if loop is None:
+        return None
+    loop.step()
+    return 0.02 if loop.busy else None
+
+
+def tag_redraw():
+    """Redraw the 3D views so the panel picks up new previews"""
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+
+def get_asset_index(root_dir):
+    """Get the asset index of a library, opening it on first use"""
+    root_dir = os.path.normpath(root_dir)
+    index = asset_indexes.get(root_dir)
+    if index is None:
+        try:
+            if not os.access(root_dir, os.W_OK):
+                raise sqlite3.OperationalError("library folder is read-only")
+            index = asset_index.AssetIndex(asset_index.get_index_path(root_dir))
+        except (OSError, sqlite3.Error):
+            # Keep the index in the user folder when it can't be stored beside the library
+            name = hashlib.sha1(root_dir.encode('utf-8')).hexdigest() + '.sqlite'
+            index = asset_index.AssetIndex(os.path.join(get_cache_dir(), name))
+        asset_indexes[root_dir] = index
+    return index
+
+
+def get_cache_dir():
+    """Folder in the Blender user resources where the add-on keeps its caches"""
+    path = bpy.utils.user_resource('DATAFILES', path='imeshh_asset_manager')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_thumbnail_cache():
+    """Cache of the thumbnails downscaled to preview resolution"""
+    if thumbnail_caches.get('main') is None:
+        thumbnail_caches['main'] = thumbnails.ThumbnailCache(
+            os.path.join(get_cache_dir(), 'thumbnails'),
+            fallback=os.path.join(os.path.dirname(__file__), 'empty.png'))
+    return thumbnail_caches['main']
+
+
+def enum_item_from_record(record, icon_id, index):
+    file_path = record.file_path
+    return (file_path, record.name, os.path.basename(file_path), icon_id, index)
+
+
+def load_preview(img_path, pcoll, store=None, key=None):
+    """
+    Load the preview of an image into the preview collection
+
+    :param img_path: Path to the image, also used as name of the preview
     :param pcoll: Preview collection
-    :return: Original enum_items parameter with the items from the asset library
+    :param store: PixelStore to keep the decoded preview in, previews found in it are
+        copied from it without decoding any image, and decoded previews are added to it
+    :param key: Key of the preview in store, None to use the content key of the image
+    :return: icon_id of the preview, None while its thumbnail is being downscaled
+    """
+    if img_path in pcoll:
+        return pcoll[img_path].icon_id
+
+    thumbnail_cache = get_thumbnail_cache()
+    content_key = thumbnail_cache.key(img_path) if store is not None and key is None else None
+    key = key or content_key
+    stored = store.get(key) if key is not None else None
+    if stored is not None:
+        return preview_from_pixels(pcoll, img_path, stored).icon_id
+
+    preview_path = thumbnail_cache.get(img_path, content_key)
+    if preview_path is None:
+        # The thumbnail is still being downscaled in the background
+        return None
+    thumb = pcoll.load(img_path, preview_path, 'IMAGE')
+    # Reading the size (to estimate its memory) decodes the image now, within
+    # the time budget of the preview loader, rather than in the middle of a redraw
+    preview_usage.add(img_path, thumb)
+
+    # The fallback of a broken HDR file isn't stored, so a fixed file gets its real preview
+    if key is not None and preview_path != thumbnail_cache.fallback:
+        width, height = thumb.image_size
+        pixels = np.empty(width * height, np.int32)
+        thumb.image_pixels.foreach_get(pixels)
+        store.put(key, width, height, pixels)
+    return thumb.icon_id
+
+
+def preview_from_pixels(pcoll, img_path, stored):
+    """Create a preview from the (width, height, pixels) tuple of a PixelStore"""
+    width, height, pixels = stored
+    thumb = pcoll.new(img_path)
+    thumb.image_size = (width, height)
+    thumb.image_pixels.foreach_set(pixels)
+    preview_usage.add(img_path, thumb)
+    return thumb
+
+
+def atlas_preview(pcoll, root_dir, record):
+    """Create the preview of an asset from the atlas of its category, return None if it isn't in it"""
+    store, key = get_preview_store(root_dir, record)
+    stored = store.get(key)
+    if stored is None:
+        return None
+    return preview_from_pixels(pcoll, record.thumb_path, stored)
+
+
+def get_preview_store(root_dir, record=None):
     """
-    if os.path.isdir(root):
-        for category in os.listdir(root):
-            scan_for_assets_category(os.path.join(root, category), enum_items, pcoll)
-    return enum_items
+    Pick the PixelStore a preview is kept in, and its key there
+
+    With the thumbnail atlas preference the previews of a category share one atlas,
+    keyed by the thumbnail path and the asset folder mtime from the index, so filling
+    a page from it touches no file of the library. Otherwise previews go in the store
+    of the library, keyed by the content of the thumbnail file.
+
+    :param root_dir: Path to the root folder of the asset library
+    :param record: AssetRecord of the asset, None if it isn't known
+    :return: (store, key) tuple, key is None when it has to be read from the thumbnail file
+    """
+    if record is not None and bpy.context.preferences.addons[__name__].preferences.use_thumbnail_atlas:
+        key = hashlib.sha1(("%s\0%r" % (record.thumb_path, record.mtime)).encode('utf-8')).hexdigest()
+        return get_pixel_store(root_dir, record.category), key
+    return get_pixel_store(root_dir), None
+
+
+def get_pixel_store(root_dir, category=None):
+    """
+    Get a store of decoded preview pixels, opening it on first use
+
+    :param root_dir: Path to the root folder of the asset library
+    :param category: Category to get the atlas of, None for the store of the whole library
+    """
+    name = hashlib.sha1(os.path.normpath(root_dir).encode('utf-8')).hexdigest()
+    path = os.path.join(get_cache_dir(), 'pixels', name)
+    if category is not None:
+        path = os.path.join(path, hashlib.sha1(category.encode('utf-8')).hexdigest())
+    store = pixel_stores.get(path)
+    if store is None:
+        store = pixel_store.PixelStore(path)
+        pixel_stores[path] = store
+    return store
+
+
+class KAM_ChangePage(bpy.types.Operator):
+    """Show the next or previous page of assets"""
+    bl_idname = "asset_manager.change_page"
+    bl_label = "Change Page"
+    bl_description = 'Show the next or previous page of assets'
+
+    step : IntProperty(default=1)
+
+    def execute(self, context):
+        manager = context.scene.asset_manager
+        view = get_current_view()
+        page_count = view.page_count(get_page_size(context)) if view else 1
+        manager.page = min(max(manager.page + self.step, 0), page_count - 1)
+        return {'FINISHED'}
+
+
+class KAM_RefreshAssets(bpy.types.Operator):
+    """Scan the asset folders again instead of using the asset index"""
+    bl_idname = "asset_manager.refresh_assets"
+    bl_label = "Refresh"
+    bl_description = 'Scan the asset folders again'
+
+    def execute(self, context):
+        root_dir = get_root_dir(context)
+        if root_dir and os.path.isdir(root_dir):
+            get_asset_index(root_dir).invalidate(context.scene.asset_manager.tabs)
+        folder_items_cache.clear()
+        stop_scan()
+        view_cache.clear()
+        catalogs.clear()
+        catalog_builds.clear()
+        catalog_views['current'] = None
+        preview_collections['main'].asset_manager_view = None
+        return {'FINISHED'}
 
 
 
@@ -667,6 +1626,77 @@ class KAM_ImportObjectButton(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class KAM_QueueAsset(bpy.types.Operator):
+    """Add the selected asset to the import queue, or one more copy of it if it is queued already"""
+    bl_idname = "asset_manager.queue_asset"
+    bl_label = "Add to Queue"
+    bl_description = 'Add the selected asset to the import queue'
+
+    @classmethod
+    def poll(cls, context):
+        return bool(get_selected_blend(context))
+
+    def execute(self, context):
+        queue = context.scene.asset_manager.import_queue
+        blend = get_selected_blend(context)
+        for item in queue:
+            if item.blend == blend:
+                item.count += 1
+                return {'FINISHED'}
+        item = queue.add()
+        item.blend = blend
+        record = get_selected_record(context)
+        item.name = record.name if record is not None else os.path.splitext(os.path.basename(blend))[0]
+        return {'FINISHED'}
+
+
+class KAM_UnqueueAsset(bpy.types.Operator):
+    """Remove an asset from the import queue"""
+    bl_idname = "asset_manager.unqueue_asset"
+    bl_label = "Remove from Queue"
+    bl_description = 'Remove the asset from the import queue'
+
+    index : IntProperty(default=0)
+
+    def execute(self, context):
+        queue = context.scene.asset_manager.import_queue
+        if 0 <= self.index < len(queue):
+            queue.remove(self.index)
+        return {'FINISHED'}
+
+
+class KAM_ClearQueue(bpy.types.Operator):
+    """Remove every asset from the import queue"""
+    bl_idname = "asset_manager.clear_queue"
+    bl_label = "Clear Queue"
+    bl_description = 'Remove every asset from the import queue'
+
+    def execute(self, context):
+        context.scene.asset_manager.import_queue.clear()
+        return {'FINISHED'}
+
+
+class KAM_ImportQueue(bpy.types.Operator):
+    """Import every queued asset in one go, opening each blend file once"""
+    bl_idname = "asset_manager.import_queue"
+    bl_label = "Import Queue"
+    bl_description = 'Import every queued asset, as a single undo step'
+    bl_options = {'REGISTER', 'UNDO'}
+    link : BoolProperty(False)
+
+    @classmethod
+    def poll(cls, context):
+        return len(context.scene.asset_manager.import_queue) > 0
+
+    def execute(self, context):
+        queue = context.scene.asset_manager.import_queue
+        requests = [(item.blend, item.count) for item in queue]
+        import_queue(context, requests, link=self.link)
+        queue.clear()
+        self.report({'INFO'}, "Imported %d assets" % sum(count for _, count in requests))
+        return {'FINISHED'}
+
+
 # Import button
 class KAM_ImportMaterialButton(bpy.types.Operator):
     bl_idname = "asset_manager.import_material"
@@ -674,7 +1704,7 @@ class KAM_ImportMaterialButton(bpy.types.Operator):
     bl_description = 'Imports material to scene'
 
     def execute(self, context):
-        import_material(context, link=False)
+        import_material(context, link=False, assign=context.window_manager.asset_manager_material_assign)
         return {'FINISHED'}
 
 # Import button
@@ -719,8 +1749,17 @@ def get_selected_file(context):
     return context.window_manager.asset_manager_prevs
 
 
+def get_selected_record(context):
+    """AssetRecord of the selected asset, None if there is none"""
+    view = get_current_view()
+    if view is None:
+        return None
+    return view.by_identifier.get(get_selected_file(context))
+
+
 def get_selected_blend(context):
-    file = get_selected_file(context)
+    record = get_selected_record(context)
+    file = record.blend_path if record is not None else get_selected_file(context)
 
     if is_blend(file):
         if context.scene.asset_manager.blend == 'corona':
@@ -744,7 +1783,13 @@ def selectable_objects(context):
 # Import objects into current scene.
 def import_object(context, link):
     # active_layer = context.view_layer.active_layer_collection
+    prepare_import(context)
+
+    blend = get_selected_blend(context)
+    if blend:
+        append_blend(blend, link)
 
+def prepare_import(context):
     # Deselect all objects
     if  bpy.ops.object.mode_set.poll():
         bpy.ops.object.mode_set(mode='OBJECT', toggle = False)
@@ -756,9 +1801,34 @@ def import_object(context, link):
             asset_coll = bpy.data.collections.new('Assets')
             context.scene.collection.children.link(asset_coll)
 
-    blend = get_selected_blend(context)
-    if blend:
-        append_blend(blend, link)
+def import_queue(context, requests, link):
+    """ Import several assets, opening each blend file once whatever the number of copies
+    - requests : (blend path, copies) tuples, a blend file may be requested several times
+    - link : link the assets instead of appending them
+    """
+    copies_by_blend = collections.OrderedDict()
+    for blend, copies in requests:
+        copies_by_blend[blend] = copies_by_blend.get(blend, 0) + copies
+
+    prepare_import(context)
+    for blend, copies in copies_by_blend.items():
+        append_blend(blend, link, copies, snap=False)
+
+    # Everything imported is selected, so it is all moved to the cursor at once
+    bpy.ops.view3d.snap_selected_to_cursor(use_offset=True)
+    tag_redraw()
+
+def duplicate_objects(objects):
+    """ Copy objects sharing their data, like Alt+D, keeping the parenting between the copies
+    - objects : objects to copy
+    - returns : the copies, in the order of objects
+    """
+    copies = [obj.copy() for obj in objects]
+    by_original = {obj.as_pointer(): copy for obj, copy in zip(objects, copies)}
+    for copy in copies:
+        if copy.parent is not None and copy.parent.as_pointer() in by_original:
+            copy.parent = by_original[copy.parent.as_pointer()]
+    return copies
 
 def create_instance_collection(collection, parent_collection):
     empty = bpy.data.objects.new(name = collection.name, object_data = None)
@@ -794,10 +1864,11 @@ def select_coll_to_import(collection_names):
     else:
         return collection_names
 
-def link_collections(blend_file, parent_col):
+def link_collections(blend_file, parent_col, copies=1):
     """ Import collections of a blend file as instances collection if it's possible
     - blend_file : file with collection to import
     - parent_col : collection of actual file wich will get as child news instances collections
+    - copies : number of instances of each collection (or copies of the linked objects)
     """
     objects_linked = False
     with bpy.data.libraries.load(blend_file, link = True) as (data_from, data_to):
@@ -812,21 +1883,23 @@ def link_collections(blend_file, parent_col):
             img.colorspace_settings.name = 'sRGB'
     #no collection found in blend file
     if objects_linked:
-        for obj in data_to.objects:
-            if bpy.context.window_manager.asset_manager_ignore_camera and obj.type == 'CAMERA':
-                continue
-            parent_col.objects.link(obj)
-            select(obj)
+        objects = [obj for obj in data_to.objects if obj is not None and not
+                   (bpy.context.window_manager.asset_manager_ignore_camera and obj.type == 'CAMERA')]
+        for copy in range(copies):
+            for obj in (objects if copy == 0 else duplicate_objects(objects)):
+                parent_col.objects.link(obj)
+                select(obj)
     else:
         #create all instances collections
-        for col in data_to.collections:
-            instance = create_instance_collection(col, parent_col)
-            if re.match(r'(^collection)', instance.name, re.IGNORECASE) and bpy.context.window_manager.asset_manager_auto_rename == True:
-                instance.name = parent_col.name
-            select(instance)
+        for copy in range(copies):
+            for col in data_to.collections:
+                instance = create_instance_collection(col, parent_col)
+                if re.match(r'(^collection)', instance.name, re.IGNORECASE) and bpy.context.window_manager.asset_manager_auto_rename == True:
+                    instance.name = parent_col.name
+                select(instance)
 
 # Import blend file
-def append_blend(blend_file, link=False):
+def append_blend(blend_file, link=False, copies=1, snap=True):
     coll_name = os.path.splitext(os.path.basename(blend_file))[0].title()
     obj_coll = get_data_colls().new(coll_name)
 
@@ -843,36 +1916,89 @@ def append_blend(blend_file, link=False):
             if img.colorspace_settings.name == '':
                 img.colorspace_settings.name = 'sRGB'
 
-        for obj in data_to.objects:
-            if bpy.context.window_manager.asset_manager_ignore_camera and obj.type == 'CAMERA':
-                continue
-            obj_coll.objects.link(obj)
-            select(obj)
+        objects = [obj for obj in data_to.objects if obj is not None and not
+                   (bpy.context.window_manager.asset_manager_ignore_camera and obj.type == 'CAMERA')]
+        # The file is only read once, the other copies share the data of the first one
+        for copy in range(copies):
+            for obj in (objects if copy == 0 else duplicate_objects(objects)):
+                obj_coll.objects.link(obj)
+                select(obj)
     else:
-        link_collections(blend_file, obj_coll)
+        link_collections(blend_file, obj_coll, copies)
 
-    bpy.ops.view3d.snap_selected_to_cursor(use_offset=True)
+    if snap:
+        bpy.ops.view3d.snap_selected_to_cursor(use_offset=True)
 
 # Import objects into current scene.
-def import_material(context, link):
+def import_material(context, link, assign='ACTIVE'):
+    """ Import the materials of the selected blend file and assign them
+    - assign : 'ACTIVE' to add them to the active object, 'REPLACE', 'APPEND' or 'MATCH'
+      to assign them to every selected mesh, see assign_materials()
+    """
     active_ob = context.active_object
+    if assign == 'ACTIVE':
+        targets = [active_ob] if active_ob is not None else []
+    else:
+        targets = [ob for ob in context.selected_objects if ob.type == 'MESH']
     if bpy.ops.object.mode_set.poll(): 
         bpy.ops.object.mode_set(mode='OBJECT', toggle = False)
-    bpy.ops.object.select_all(action='DESELECT')
+    if assign == 'ACTIVE':
+        bpy.ops.object.select_all(action='DESELECT')
 
     blend = get_selected_blend(context)
-    files = []
-    with bpy.data.libraries.load(blend) as (data_from, data_to):
-        for name in data_from.materials:
-            files.append({'name': name})
-    action = bpy.ops.wm.link if link else bpy.ops.wm.append
-    action(directory=blend + "/Material/", files=files)
-
-    if active_ob is not None:
-        for file in files:
-            mat = bpy.data.materials[file['name']]
-            active_ob.data.materials.append(mat)
-            select(active_ob)
+    # Read and append the materials in the same pass over the file
+    with bpy.data.libraries.load(blend, link = link) as (data_from, data_to):
+        data_to.materials = data_from.materials
+
+    # fix if color space unrecognized
+    for img in bpy.data.images:
+        if img.colorspace_settings.name == '':
+            img.colorspace_settings.name = 'sRGB'
+
+    materials = [mat for mat in data_to.materials if mat is not None]
+    assign_materials(targets, materials, 'APPEND' if assign == 'ACTIVE' else assign)
+    if assign == 'ACTIVE':
+        for ob in targets:
+            select(ob)
+
+def material_base_name(name):
+    """Name of a material without the .001 suffix Blender adds to duplicate names"""
+    return re.sub(r'\.\d{3}$', '', name).lower()
+
+def assign_materials(objects, materials, mode):
+    """ Assign materials to objects in one pass through the data API
+    - objects : objects to assign the materials to, those whose data can't hold materials are skipped
+    - materials : materials to assign
+    - mode : 'REPLACE' puts the first material in the active slot of each object,
+      'APPEND' adds the materials in new slots, once per mesh shared by several objects,
+      'MATCH' replaces the material of every slot whose name matches one of the materials
+    """
+    if not materials:
+        return
+    objects = [ob for ob in objects if getattr(ob.data, 'materials', None) is not None]
+
+    if mode == 'APPEND':
+        done = set()
+        for ob in objects:
+            if ob.data.as_pointer() in done:
+                continue
+            done.add(ob.data.as_pointer())
+            for mat in materials:
+                ob.data.materials.append(mat)
+    elif mode == 'REPLACE':
+        for ob in objects:
+            if len(ob.material_slots) == 0:
+                ob.data.materials.append(materials[0])
+            else:
+                ob.material_slots[ob.active_material_index].material = materials[0]
+    elif mode == 'MATCH':
+        by_name = {material_base_name(mat.name): mat for mat in materials}
+        for ob in objects:
+            for slot in ob.material_slots:
+                if slot.material is not None and slot.material not in materials:
+                    mat = by_name.get(material_base_name(slot.material.name))
+                    if mat is not None:
+                        slot.material = mat
 
 def import_hdr_cycles(context):
     hdr = get_selected_hdr(context)
@@ -961,6 +2087,21 @@ def update_hdri_rotation_corona(corona, rotation):
 
 
 preview_collections = {}
+asset_indexes = {}
+thumbnail_caches = {}
+pixel_stores = {}
+
+# Enum items of the recently shown views by (tab, root, category, subcategory), least recently shown first
+view_cache = collections.OrderedDict()
+
+# Shown search or filter results, they are cheap to make again so only the last one is kept
+catalog_views = {'current': None}
+
+# Name index, facet index and records of the indexed assets by (tab, root)
+catalogs = {}
+
+# Tasks of the scan loop building the catalogs, by (tab, root)
+catalog_builds = {}
 
 # Classes to register
 classes = (
@@ -972,8 +2113,15 @@ classes = (
     KAM_OpenThumbnail,
     KAM_ImportHDR,
     KAM_ImportObjectButton,
+    KAM_QueueAsset,
+    KAM_UnqueueAsset,
+    KAM_ClearQueue,
+    KAM_ImportQueue,
     KAM_ImportMaterialButton,
     KAM_LinkToButton,
+    KAM_RefreshAssets,
+    KAM_ChangePage,
+    KAM_ImportQueueItem,
     KrisAssetManager,
 )
 
@@ -1013,11 +2161,23 @@ def register():
         description="This addon, by default, will just import the scene collection. This will then auto-rename the scene collection to the assets file name. This will make it easier to find in the library")
 
 
+    WindowManager.asset_manager_material_assign = EnumProperty(
+        items=[('ACTIVE', 'Active Object', 'Add the imported materials to the active object'),
+               ('REPLACE', 'Replace Slot', 'Put the imported material in the active slot of every selected mesh'),
+               ('APPEND', 'Append Slot', 'Add the imported materials in new slots of every selected mesh'),
+               ('MATCH', 'Match Slot Names', 'Replace the materials of the selected meshes that have the name'
+                                             ' of an imported material')],
+        name="Assign imported materials",
+        default='ACTIVE',
+        description="Objects the imported materials are assigned to")
+
     WindowManager.asset_manager_prevs = EnumProperty(items=scan_directory, update=select_tab)
 
     pcoll = bpy.utils.previews.new()
-    pcoll.asset_manager_prev_dir = ""
-    pcoll.asset_manager_prevs = ""
+    pcoll.asset_manager_view = None
+    pcoll.asset_manager_prevs = []
+    pcoll.asset_manager_pending = {}
+    pcoll.asset_manager_page_thumbs = set()
 
     preview_collections["main"] = pcoll
     bpy.types.Scene.asset_manager = PointerProperty(type=KrisAssetManager)
@@ -1029,12 +2189,39 @@ def unregister():
 
     del WindowManager.asset_manager_prevs
     del WindowManager.asset_manager_ignore_camera
+    del WindowManager.asset_manager_material_assign
     
     for pcoll in preview_collections.values():
         bpy.utils.previews.remove(pcoll)
 
+    stop_scan()
+    view_cache.clear()
+    catalog_views['current'] = None
+    catalogs.clear()
+    catalog_builds.clear()
+    if bpy.app.timers.is_registered(process_scan_loop):
+        bpy.app.timers.unregister(process_scan_loop)
+    for loop in scan_loops.values():
+        loop.close()
+    scan_loops.clear()
+    preview_queue.clear()
+    preview_usage.clear()
+    if bpy.app.timers.is_registered(process_preview_queue):
+        bpy.app.timers.unregister(process_preview_queue)
+
     preview_collections.clear()
 
+    for index in asset_indexes.values():
+        index.close()
+    asset_indexes.clear()
+    for thumbnail_cache in thumbnail_caches.values():
+        thumbnail_cache.shutdown()
+    thumbnail_caches.clear()
+
+    for store in pixel_stores.values():
+        store.close()
+    pixel_stores.clear()
+
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
 
@@ -0,0 +1,461 @@
+"""
+Persistent on-disk index of an asset library.
+
+One SQLite file per library root holds a row per asset folder (or loose HDR
+file), so the panel can list a category without walking the directory tree.
+The index is reused across Blender sessions. The mtime of every category and
+subcategory folder is recorded, and category folders are only listed again when
+their mtime moved. The folders holding asset folders are listed on every update
+and each asset folder is stat'ed, since adding a file to an asset folder doesn't
+change the mtime of its parent. Asset folders are only listed again when their
+own mtime moved. The mtime of a folder changed in the last few seconds isn't
+recorded, the folder may still be being copied into (see scanner.stable_mtime()).
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from . import scanner
+
+# The index lives in its own hidden folder so that writing to it (and to the
+# SQLite journal) never changes the mtime of the library root itself
+INDEX_DIR_NAME = '.imeshh'
+INDEX_FILE_NAME = 'index.sqlite'
+SCHEMA_VERSION = 3
+
+# Order of the columns of the asset rows read from the index
+ASSET_COLUMNS = ('path', 'category', 'subcategory', 'name', 'blend_path', 'hdr_path', 'thumb_path', 'mtime',
+                 'size', 'variants')
+
+# Number of rows read from the index at a time by the iter_* queries
+QUERY_BATCH_SIZE = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS assets (
+    tab TEXT NOT NULL,
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    container TEXT NOT NULL,
+    category TEXT NOT NULL,
+    subcategory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    blend_path TEXT NOT NULL,
+    hdr_path TEXT NOT NULL,
+    thumb_path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    variants INTEGER NOT NULL,
+    PRIMARY KEY (tab, path)
+);
+CREATE INDEX IF NOT EXISTS assets_view ON assets (tab, root, category, subcategory);
+CREATE INDEX IF NOT EXISTS assets_container ON assets (tab, container);
+CREATE TABLE IF NOT EXISTS directories (
+    tab TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    scanned_at REAL NOT NULL,
+    PRIMARY KEY (tab, path)
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (tab, parent);
+"""
+
+
+def get_index_path(root):
+    """Path of the index file kept beside the assets of the library at root"""
+    return os.path.join(root, INDEX_DIR_NAME, INDEX_FILE_NAME)
+
+
+def split_asset_path(root, path):
+    """
+    Split the path of an asset into its category and subcategory
+
+    :param root: Path to the root folder of the asset library
+    :param path: Path to the asset folder (or loose HDR file)
+    :return: (category, subcategory) tuple, subcategory is '' for libraries without subcategories
+    """
+    parts = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+    category = parts[0] if parts[0] != os.curdir else ''
+    subcategory = parts[1] if len(parts) > 1 else ''
+    return category, subcategory
+
+
+class AssetRecord:
+    """
+    One asset of a library
+
+    Paths are stored relative to the library root, which is shared by all the
+    records of a library, to keep large views small in memory. size and variants
+    are those of scanner.ScanRecord.
+    """
+    __slots__ = ('root', 'path', 'category', 'subcategory', 'name', 'blend', 'hdr', 'thumb', 'mtime',
+                 'size', 'variants')
+
+    def __init__(self, root, path, category, subcategory, name, blend, hdr, thumb, mtime, size, variants):
+        self.root = root
+        self.path = path
+        self.category = category
+        self.subcategory = subcategory
+        self.name = name
+        self.blend = blend
+        self.hdr = hdr
+        self.thumb = thumb
+        self.mtime = mtime
+        self.size = size
+        self.variants = variants
+
+    @classmethod
+    def from_row(cls, root, row):
+        """Make a record from an index row (see ASSET_COLUMNS) of the library at root"""
+        path, category, subcategory, name, blend_path, hdr_path, thumb_path, mtime, size, variants = row
+        start = len(os.path.join(root, ''))
+        return cls(root, path[start:], category, subcategory, name,
+                   blend_path[start:], hdr_path[start:], thumb_path[start:], mtime, size, variants)
+
+    def _abspath(self, path):
+        return os.path.join(self.root, path) if path else ''
+
+    @property
+    def asset_path(self):
+        return os.path.join(self.root, self.path)
+
+    @property
+    def blend_path(self):
+        return self._abspath(self.blend)
+
+    @property
+    def hdr_path(self):
+        return self._abspath(self.hdr)
+
+    @property
+    def thumb_path(self):
+        return self._abspath(self.thumb)
+
+    @property
+    def file_path(self):
+        """The blend (or HDR) file of the asset, used as identifier of its enum item"""
+        return self.blend_path or self.hdr_path or os.path.join(self.asset_path, 'no blend')
+
+    def __repr__(self):
+        return "<AssetRecord %s>" % self.path
+
+
+class AssetIndex:
+    """
+    SQLite backed index of the assets found below one or more library roots
+
+    The connection is shared between threads and guarded by a lock, so the
+    index can be filled by a background scan while the UI queries it.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if row is None or int(row[0]) != SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS assets")
+                self._conn.execute("DROP TABLE IF EXISTS directories")
+                self._conn.executescript(_SCHEMA)
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            # Left by earlier versions, which recorded the datablocks of imported blend files
+            self._conn.execute("DROP TABLE IF EXISTS blend_contents")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _directory_mtime(self, tab, path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime FROM directories WHERE tab = ? AND path = ?", (tab, path)).fetchone()
+        return row[0] if row is not None else None
+
+    def _child_directories(self, tab, path):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM directories WHERE tab = ? AND parent = ? ORDER BY path", (tab, path)).fetchall()
+        return [row[0] for row in rows]
+
+    def _forget_directory(self, tab, path):
+        """Drop a folder that disappeared, with everything indexed below it"""
+        prefix = os.path.join(path, '')
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM assets WHERE tab = ? AND (container = ? OR substr(container, 1, ?) = ?)",
+                (tab, path, len(prefix), prefix))
+            self._conn.execute(
+                "DELETE FROM directories WHERE tab = ? AND (path = ? OR substr(path, 1, ?) = ?)",
+                (tab, path, len(prefix), prefix))
+
+    async def update_async(self, tab, root, directory, depth, on_container=None, workers=1, timeout=None,
+                           cancelled=None):
+        """
+        Coroutine bringing the index up to date for every asset below directory
+
+        Every folder on the way down is stat'ed, but only the folders whose mtime
+        moved since the last update are listed again. The filesystem calls run in
+        the default executor of the running loop, at most workers at a time. A folder
+        that doesn't answer within timeout seconds (a hung network mount) is skipped
+        and its assets are reported as they were last indexed. Cancelling the coroutine
+        stops it before the next folder is listed, setting cancelled as well also
+        interrupts the folders being listed.
+
+        :param tab: Tab the directory is listed in (the folder layout depends on it)
+        :param root: Path to the root folder of the asset library
+        :param directory: Directory to update
+        :param depth: Number of folder levels between directory and the asset folders,
+            0 when directory directly holds the asset folders
+        :param on_container: Called with the path of each folder holding asset folders
+            as soon as its assets are up to date, in sorted order
+        :param workers: Number of folders listed at the same time
+        :param timeout: Seconds to wait for each folder, None to wait forever
+        :param cancelled: threading.Event aborting the update with scanner.ScanCancelled once set.
+            The folders brought up to date until then are kept, and so are the asset folders
+            already listed in an interrupted folder, so the next update picks up from there
+        :return: True if any folder was added, removed or listed again
+        """
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(workers)
+
+        async def call(path, func, *args):
+            async with limit:
+                try:
+                    return await asyncio.wait_for(loop.run_in_executor(None, func, tab, *args), timeout)
+                except asyncio.TimeoutError:
+                    print("Timed out reading %s" % path)
+                    return _TIMED_OUT
+
+        root = os.path.normpath(root)
+        directory = os.path.normpath(directory)
+
+        level = [(directory, os.path.dirname(directory))]
+        expanded = []
+        changed = False
+        for _ in range(depth):
+            children = []
+            calls = [call(path, self._expand_directory, path, parent, cancelled) for path, parent in level]
+            async for (path, parent), result in _in_order(level, calls):
+                if result is _TIMED_OUT:
+                    # Keep what is indexed below the folder, it is listed again on the next update
+                    children.extend((child, path) for child in self._child_directories(tab, path))
+                elif result is None:
+                    changed = True
+                else:
+                    mtime, child_paths, listed = result
+                    expanded.append((path, parent, mtime))
+                    children.extend((child, path) for child in child_paths)
+                    changed = changed or listed
+            level = children
+
+        calls = [call(path, self._refresh_container, root, path, parent, cancelled) for path, parent in level]
+        async for (path, _), result in _in_order(level, calls):
+            if result is None:
+                changed = True
+                continue
+            changed = changed or result is True
+            if on_container is not None:
+                on_container(path)
+
+        # Only recorded once all the folders below are up to date, so an interrupted update is resumed
+        for path, parent, mtime in reversed(expanded):
+            self._record_directory(tab, path, parent, mtime)
+        return changed
+
+    def is_indexed(self, tab, directory):
+        """True once an update of directory ran to the end, so everything below it is in the index"""
+        return self._directory_mtime(tab, os.path.normpath(directory)) is not None
+
+    def _expand_directory(self, tab, path, parent, cancelled=None):
+        """
+        Find the folders inside a folder that doesn't directly hold asset folders
+
+        :return: (mtime, child paths, listed) tuple where listed is True if the folder
+            was listed again, None if the folder disappeared
+        """
+        scanner.check_cancelled(cancelled)
+        mtime = scanner.path_mtime(path)
+        if mtime is None:
+            self._forget_directory(tab, path)
+            return None
+
+        if mtime == self._directory_mtime(tab, path):
+            # No folder was added or removed, but the folders below may still have changed
+            return mtime, self._child_directories(tab, path), False
+
+        children = scanner.list_subfolders(path)
+        for child in set(self._child_directories(tab, path)) - set(children):
+            self._forget_directory(tab, child)
+        return scanner.stable_mtime(mtime), children, True
+
+    def _refresh_container(self, tab, root, path, parent, cancelled=None):
+        """
+        Bring the assets of a folder holding asset folders up to date
+
+        :return: True if its assets changed, False if they didn't, None if it disappeared
+        """
+        scanner.check_cancelled(cancelled)
+        mtime = scanner.path_mtime(path)
+        if mtime is None:
+            self._forget_directory(tab, path)
+            return None
+        return self._update_container(tab, root, path, parent, mtime, cancelled)
+
+    def _update_container(self, tab, root, path, parent, mtime, cancelled=None):
+        """
+        List a folder holding asset folders, reusing the asset folders whose mtime didn't move
+
+        :return: True if its assets changed
+        """
+        with self._lock:
+            known = {row[0]: scanner.ScanRecord(*row) for row in self._conn.execute(
+                "SELECT path, name, blend_path, hdr_path, thumb_path, mtime, size, variants FROM assets "
+                "WHERE tab = ? AND container = ?", (tab, path))}
+
+        found = []
+        try:
+            for record in scanner.iter_assets_subcategory(path, known, cancelled):
+                found.append(record)
+        except scanner.ScanCancelled:
+            # Keep the asset folders listed so far, the next update reuses them as known
+            # records. The folder mtime isn't recorded so it is listed again then
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._asset_rows(tab, root, path, found))
+            raise
+
+        mtime = scanner.stable_mtime(mtime)
+        changed = len(found) != len(known) or any(known.get(record.path) != record for record in found)
+        if not changed:
+            if mtime != self._directory_mtime(tab, path):
+                self._record_directory(tab, path, parent, mtime)
+            return False
+
+        records = self._asset_rows(tab, root, path, found)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM assets WHERE tab = ? AND container = ?", (tab, path))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+            self._conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                               (tab, path, parent, mtime, time.time()))
+        return True
+
+    @staticmethod
+    def _asset_rows(tab, root, container, records):
+        """Rows of the assets table for the scanner records of the asset folders in container"""
+        rows = []
+        for record in records:
+            category, subcategory = split_asset_path(root, record[0])
+            rows.append((tab, root, record[0], container, category, subcategory) + tuple(record[1:]))
+        return rows
+
+    def _record_directory(self, tab, path, parent, mtime):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                               (tab, path, parent, mtime, time.time()))
+
+    def invalidate(self, tab=None):
+        """Forget every recorded mtime so the next update lists all the folders again"""
+        with self._lock, self._conn:
+            if tab is None:
+                self._conn.execute("UPDATE directories SET mtime = -1")
+                self._conn.execute("UPDATE assets SET mtime = -1")
+            else:
+                self._conn.execute("UPDATE directories SET mtime = -1 WHERE tab = ?", (tab,))
+                self._conn.execute("UPDATE assets SET mtime = -1 WHERE tab = ?", (tab,))
+
+    def iter_query(self, tab, root, category=None, subcategory=None):
+        """
+        Yield the indexed assets of a view, reading them from the index in batches
+
+        :param tab: Tab the assets are listed in
+        :param root: Path to the root folder of the asset library
+        :param category: Only list assets of this category (None for all)
+        :param subcategory: Only list assets of this subcategory (None for all)
+        :return: Iterator over AssetRecords
+        """
+        root = os.path.normpath(root)
+        where = "tab = ? AND root = ?"
+        args = [tab, root]
+        if category is not None:
+            where += " AND category = ?"
+            args.append(category)
+        if subcategory is not None:
+            where += " AND subcategory = ?"
+            args.append(subcategory)
+        return self._iter_records(root, where, args, ('category', 'subcategory', 'name', 'path'))
+
+    def iter_container(self, tab, root, container):
+        """
+        Yield the indexed assets directly inside one folder
+
+        :param tab: Tab the assets are listed in
+        :param root: Path to the root folder of the asset library
+        :param container: Path to the folder holding the asset folders
+        :return: Iterator over AssetRecords
+        """
+        root = os.path.normpath(root)
+        return self._iter_records(root, "tab = ? AND container = ?", [tab, os.path.normpath(container)],
+                                  ('name', 'path'))
+
+    def _iter_records(self, root, where, args, order):
+        """
+        Yield the AssetRecords of the rows matching where, sorted by the order columns
+
+        Each batch is a query of its own that resumes after the last row of the previous
+        one, so no statement stays open while a background update writes to the index.
+        """
+        select = "SELECT " + ", ".join(ASSET_COLUMNS) + " FROM assets WHERE " + where
+        tail = " ORDER BY " + ", ".join(order) + " LIMIT %d" % QUERY_BATCH_SIZE
+        after = " AND (" + ", ".join(order) + ") > (" + ", ".join("?" * len(order)) + ")"
+        positions = [ASSET_COLUMNS.index(column) for column in order]
+
+        last = None
+        while True:
+            with self._lock:
+                if last is None:
+                    rows = self._conn.execute(select + tail, args).fetchall()
+                else:
+                    rows = self._conn.execute(select + after + tail, list(args) + last).fetchall()
+            for row in rows:
+                yield AssetRecord.from_row(root, row)
+            if len(rows) < QUERY_BATCH_SIZE:
+                break
+            last = [rows[-1][i] for i in positions]
+
+    def query(self, tab, root, category=None, subcategory=None):
+        """List of the AssetRecords of a view, see iter_query()"""
+        return list(self.iter_query(tab, root, category, subcategory))
+
+    def query_container(self, tab, root, container):
+        """List of the AssetRecords directly inside one folder, see iter_container()"""
+        return list(self.iter_container(tab, root, container))
+
+
+# Result of a folder that didn't answer in time
+_TIMED_OUT = object()
+
+
+async def _in_order(items, calls):
+    """
+    Run coroutines concurrently and yield (item, result) pairs in the order of items
+
+    The coroutines that haven't finished are cancelled when the iteration stops early.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in calls]
+    try:
+        for item, task in zip(items, tasks):
+            yield item, await task
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,54 @@
+"""
+asyncio event loop run in steps from the main thread of the host application.
+
+Blender can't block its main thread on an event loop, so the loop is never
+run forever: step() runs the callbacks that are ready and returns, and is
+called from a bpy.app.timers callback while tasks are pending. Blocking
+filesystem calls are handed to the default executor with run_in_executor,
+so coroutines only ever run on the main thread and may touch bpy data.
+"""
+import asyncio
+import concurrent.futures
+
+
+class SteppedLoop:
+    """
+    Event loop advanced one step at a time
+
+    :param max_workers: Maximum number of threads of the executor blocking calls run in
+    """
+
+    def __init__(self, max_workers):
+        self.loop = asyncio.new_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.loop.set_default_executor(self._executor)
+        self._tasks = set()
+
+    def create_task(self, coro):
+        """Schedule a coroutine, it starts running on the next step"""
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @property
+    def busy(self):
+        return bool(self._tasks)
+
+    def step(self):
+        """Run the callbacks that are ready, without waiting for anything"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def close(self):
+        """Cancel the pending tasks and close the loop, calls still running in the executor are abandoned"""
+        if self.loop.is_closed():
+            return
+        for task in list(self._tasks):
+            task.cancel()
+        # Let the cancelled tasks run their cleanup
+        self.step()
+        self._executor.shutdown(wait=False)
+        self.loop.close()
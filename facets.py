@@ -0,0 +1,116 @@
+"""
+Facet filters over the assets of a library, as precomputed bitsets.
+
+Every facet (file type, render variant, has-thumbnail, file size range,
+category and subcategory) is one Python int with bit i set when asset i has
+it, so combining any number of filters is a few integer ANDs and ORs over the
+whole library instead of a walk of the folder tree. The filter_* functions
+select the same assets from a stream of records, for when the bitsets aren't
+built yet.
+"""
+from . import scanner
+
+MB = 1024 * 1024
+
+# File size facets, as (facet, smallest size, largest size excluded)
+SIZE_FACETS = (
+    ('SMALL', 0, 10 * MB),
+    ('MEDIUM', 10 * MB, 100 * MB),
+    ('LARGE', 100 * MB, float('inf')),
+)
+
+
+def record_facets(record):
+    """Names of the facets of an asset record (an AssetRecord or scanner.ScanRecord)"""
+    facets = []
+    if record.blend_path:
+        facets.append('BLEND')
+    if record.hdr_path:
+        facets.append('HDR')
+    if record.variants & scanner.VARIANT_CYCLES:
+        facets.append('CYCLES')
+    if record.variants & scanner.VARIANT_CORONA:
+        facets.append('CORONA')
+    if record.thumb_path and not scanner.is_hdr(record.thumb_path):
+        facets.append('THUMBNAIL')
+    for facet, smallest, largest in SIZE_FACETS:
+        if smallest <= record.size < largest:
+            facets.append(facet)
+    return facets
+
+
+def bits_of(ids):
+    """Bitset of a collection of asset ids"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    # Set the bits in a byte buffer, ORing into a growing int would copy it for every id
+    buffer = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        buffer[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def ids_of(bits):
+    """Ascending list of the asset ids in a bitset"""
+    return [i for i, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1']
+
+
+def filter_facets(records, groups):
+    """Keep the records matching facet groups, see FacetIndex.match()"""
+    groups = [set(group) for group in groups if group]
+    return (record for record in records
+            if all(group.intersection(record_facets(record)) for group in groups))
+
+
+def filter_category(records, category, subcategory=None):
+    """Keep the records of a category, or of one of its subcategories, see FacetIndex.category()"""
+    return (record for record in records if record.category == category and
+            (subcategory is None or record.subcategory == subcategory))
+
+
+class FacetIndex:
+    """
+    Bitsets of every facet over a list of asset records, asset ids are positions in that list
+
+    :param records: AssetRecords of the library
+    """
+
+    def __init__(self, records):
+        facets = {}
+        categories = {}
+        subcategories = {}
+        for i, record in enumerate(records):
+            for facet in record_facets(record):
+                facets.setdefault(facet, []).append(i)
+            categories.setdefault(record.category, []).append(i)
+            subcategories.setdefault((record.category, record.subcategory), []).append(i)
+        self.all = (1 << len(records)) - 1
+        self._facets = {name: bits_of(ids) for name, ids in facets.items()}
+        self._categories = {name: bits_of(ids) for name, ids in categories.items()}
+        self._subcategories = {key: bits_of(ids) for key, ids in subcategories.items()}
+
+    def facet(self, name):
+        return self._facets.get(name, 0)
+
+    def category(self, category, subcategory=None):
+        """Bitset of the assets of a category, or of one of its subcategories"""
+        if subcategory is None:
+            return self._categories.get(category, 0)
+        return self._subcategories.get((category, subcategory), 0)
+
+    def match(self, groups):
+        """
+        Bitset of the assets matching facet groups
+
+        :param groups: Iterable of collections of facet names. An asset matches when it has
+            at least one facet of every group, empty groups are ignored
+        """
+        bits = self.all
+        for group in groups:
+            if group:
+                any_of = 0
+                for name in group:
+                    any_of |= self.facet(name)
+                bits &= any_of
+        return bits
@@ -0,0 +1,196 @@
+"""
+Persistent store of decoded preview pixels.
+
+Previews are kept as raw 32 bit RGBA pixels in fixed-size tiles of one
+memory-mapped file, with a small JSON index giving the tile and size of each
+preview. Loading a preview from the store is a memory copy into
+ImagePreview.image_pixels, no image file has to be opened or decoded.
+
+Several Blender sessions may share a store: tiles are only ever appended, the
+slot of a tile is where it actually landed in the file, and the index is merged
+with the one on disk when it is written. Tiles of previews stored again are
+reclaimed by rewriting the live tiles to a new pixels file once they make up
+less than half of it.
+"""
+import json
+import os
+
+import numpy as np
+
+# Side of the square tiles, previews larger than this are not stored
+TILE_SIZE = 128
+
+# Superseded tiles kept before the pixels file is compacted, whatever the number of live tiles
+MIN_DEAD_TILES = 256
+
+
+class PixelStore:
+    """
+    Tiles of preview pixels in one memory-mapped file
+
+    :param path: Path of the store without extension, the index goes in path.json
+        and the pixels in path.pixels (path.<generation>.pixels once compacted)
+    :param tile_size: Side of the square tiles
+    """
+
+    def __init__(self, path, tile_size=TILE_SIZE):
+        self.path = path
+        self.index_path = path + '.json'
+        self.tile_size = tile_size
+        self.tile_bytes = tile_size * tile_size * 4
+        self._map = None
+        self._added = {}
+        self._generation, self._index = self._read_index()
+        self.pixels_path = self._pixels_path(self._generation)
+        self._count = self._file_tiles()
+        # Tiles past the end of the pixels file (after a crash) can't be used
+        self._index = self._live(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def _pixels_path(self, generation):
+        if generation == 0:
+            return self.path + '.pixels'
+        return '%s.%d.pixels' % (self.path, generation)
+
+    def _read_index(self):
+        """Read the index on disk, return its (generation, tiles)"""
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+            if data.get('tile_size') == self.tile_size:
+                return data.get('generation', 0), data['tiles']
+        except (OSError, ValueError, KeyError):
+            pass
+        return 0, {}
+
+    def _file_tiles(self):
+        """Number of whole tiles in the pixels file"""
+        try:
+            return os.path.getsize(self.pixels_path) // self.tile_bytes
+        except OSError:
+            return 0
+
+    def _live(self, tiles):
+        return {key: tile for key, tile in tiles.items() if tile[0] < self._count}
+
+    def _tiles(self):
+        """Memory map of all the tiles, mapped again when tiles were added since"""
+        if self._map is None or len(self._map) < self._count:
+            self._map = np.memmap(self.pixels_path, dtype=np.int32, mode='r',
+                                  shape=(self._count, self.tile_size * self.tile_size))
+        return self._map
+
+    def get(self, key):
+        """
+        Get the pixels of a preview
+
+        :param key: Key the preview was stored under
+        :return: (width, height, pixels) tuple with pixels as a flat int32 array of packed RGBA,
+            or None if the preview isn't stored
+        """
+        tile = self._index.get(key)
+        if tile is None:
+            return None
+        slot, width, height = tile
+        return width, height, self._tiles()[slot, :width * height]
+
+    def put(self, key, width, height, pixels):
+        """
+        Store the pixels of a preview
+
+        :param key: Key to store the preview under
+        :param width: Width of the preview
+        :param height: Height of the preview
+        :param pixels: Flat array of width * height packed RGBA pixels
+        :return: True if the preview was stored, False if it is larger than a tile
+            or the file changed under it
+        """
+        if width * height == 0 or width > self.tile_size or height > self.tile_size:
+            return False
+        tile = np.zeros(self.tile_size * self.tile_size, np.int32)
+        tile[:width * height] = pixels
+
+        os.makedirs(os.path.dirname(self.pixels_path), exist_ok=True)
+        # Unbuffered append, so the tile is one write landing at the end of the file
+        # even when another session appends to it too
+        with open(self.pixels_path, 'ab', buffering=0) as f:
+            # Pad a tile cut short by a crash, so the new one starts on a tile boundary
+            padding = -os.fstat(f.fileno()).st_size % self.tile_bytes
+            data = bytes(padding) + tile.tobytes()
+            if f.write(data) != len(data):
+                return False
+            end = f.tell()
+        if end % self.tile_bytes:
+            # Another session wrote a partial tile at the same time
+            return False
+        slot = end // self.tile_bytes - 1
+        self._index[key] = self._added[key] = [slot, width, height]
+        self._count = max(self._count, slot + 1)
+        return True
+
+    def flush(self):
+        """
+        Write the index, so the tiles added since are found in the next session
+
+        The index on disk is read again first, so the tiles other sessions added are kept.
+        """
+        if not self._added:
+            return
+        generation, tiles = self._read_index()
+        if generation != self._generation:
+            # Another session compacted the store, the tiles added here are in the old
+            # pixels file and are dropped, they'll be stored again when next loaded
+            self._generation = generation
+            self.pixels_path = self._pixels_path(generation)
+            self._map = None
+            self._added = {}
+            self._count = self._file_tiles()
+            self._index = self._live(tiles)
+            return
+        self._count = max(self._count, self._file_tiles())
+        tiles = self._live(tiles)
+        tiles.update(self._added)
+        self._index = tiles
+        self._added = {}
+        if self._count - len(tiles) > max(len(tiles), MIN_DEAD_TILES):
+            self.compact()
+        else:
+            self._write_index()
+
+    def compact(self):
+        """Copy the live tiles to a new pixels file, dropping the tiles of the previews stored again"""
+        tiles_map = self._tiles()
+        generation = self._generation + 1
+        pixels_path = self._pixels_path(generation)
+        index = {}
+        with open(pixels_path, 'wb') as f:
+            for key, (old_slot, width, height) in sorted(self._index.items(), key=lambda item: item[1][0]):
+                f.write(tiles_map[old_slot].tobytes())
+                index[key] = [len(index), width, height]
+        old_path = self.pixels_path
+        self._map = None
+        self._generation = generation
+        self.pixels_path = pixels_path
+        self._index = index
+        self._count = len(index)
+        self._write_index()
+        try:
+            os.remove(old_path)
+        except OSError:
+            # Still mapped by another session (on Windows), left behind
+            pass
+
+    def _write_index(self):
+        temp_path = '%s.%d.tmp' % (self.index_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'tile_size': self.tile_size, 'generation': self._generation, 'tiles': self._index}, f)
+        os.replace(temp_path, self.index_path)
+
+    def close(self):
+        self.flush()
+        self._map = None
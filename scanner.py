@@ -0,0 +1,239 @@
+"""
+Filesystem scanner for the asset library.
+
+Every folder is listed exactly once with os.scandir and the file types are
+classified from that single listing, using the type information cached on
+the DirEntry objects instead of extra stat calls. This matters on network
+shares where each call is a round trip.
+
+iter_assets_subcategory() yields one asset at a time, so the asset index can
+keep what was listed so far when a scan is interrupted.
+"""
+import collections
+import os
+import threading
+import time
+
+
+def is_hdr(file):
+    return file.lower().endswith(('.hdr', '.hdri', '.exr'))
+
+
+def is_blend(file):
+    return file.lower().endswith(('.blend',))
+
+
+def is_image(file):
+    return file.lower().endswith(('.png', '.jpg'))
+
+
+# Render variants of the blend files of an asset, as bit flags
+VARIANT_CYCLES = 1
+VARIANT_CORONA = 2
+
+
+def blend_variant(file):
+    """Render variant of a blend file, from the Cycles/Corona naming of the iMeshh files"""
+    return VARIANT_CORONA if 'corona' in os.path.basename(file).lower() else VARIANT_CYCLES
+
+
+# Seconds during which a folder that changed may still be being written to
+FRESH_SECONDS = 5.0
+
+
+def stable_mtime(mtime):
+    """
+    mtime to record for a folder or file, 0 while it changed too recently to be trusted
+
+    A folder being copied changes several times within the resolution of its mtime
+    (up to 2 seconds on network shares), so an mtime recorded then could match the
+    final one. Recording 0 instead makes the next update read it again.
+    """
+    return 0 if time.time() - mtime < FRESH_SECONDS else mtime
+
+
+class SyscallCounter:
+    """
+    Count the filesystem calls made by the scanner, to verify how many round trips a scan costs
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.scandir = 0
+        self.stat = 0
+
+    @property
+    def total(self):
+        return self.scandir + self.stat
+
+    def add(self, scandir=0, stat=0):
+        with self._lock:
+            self.scandir += scandir
+            self.stat += stat
+
+    def reset(self):
+        with self._lock:
+            self.scandir = 0
+            self.stat = 0
+
+    def __repr__(self):
+        return "<SyscallCounter scandir=%d stat=%d>" % (self.scandir, self.stat)
+
+
+syscalls = SyscallCounter()
+
+
+class ScanCancelled(Exception):
+    """Raised inside a scan when its cancel event is set"""
+
+
+def check_cancelled(cancelled):
+    """Raise ScanCancelled if the cancelled event (a threading.Event, or None) is set"""
+    if cancelled is not None and cancelled.is_set():
+        raise ScanCancelled()
+
+
+def list_dir(path):
+    """
+    List a folder once
+
+    :param path: Folder to list
+    :return: List of os.DirEntry, sorted by name. Empty if the folder can't be read
+    """
+    syscalls.add(scandir=1)
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return []
+    entries.sort(key=lambda entry: entry.name)
+    return entries
+
+
+def entry_mtime(entry):
+    """mtime of a DirEntry, or None if it can't be read"""
+    syscalls.add(stat=1)
+    try:
+        return entry.stat().st_mtime
+    except OSError:
+        return None
+
+
+def entry_size(entry):
+    """Size in bytes of the file of a DirEntry, 0 if it can't be read"""
+    syscalls.add(stat=1)
+    try:
+        return entry.stat().st_size
+    except OSError:
+        return 0
+
+
+def path_mtime(path):
+    """mtime of path, or None if it can't be read"""
+    syscalls.add(stat=1)
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def classify_entries(entries):
+    """
+    Pick the blend, HDR and preview image files out of the listing of an asset folder
+
+    :param entries: List of os.DirEntry of the asset folder
+    :return: (blend_path, hdr_path, img_path) tuple, '' for the files that weren't found
+    """
+    blend_path = hdr_path = img_path = ''
+    for entry in entries:
+        if is_blend(entry.name):
+            blend_path = blend_path or entry.path
+        elif is_hdr(entry.name):
+            hdr_path = hdr_path or entry.path
+        elif is_image(entry.name):
+            img_path = img_path or entry.path
+    return blend_path, hdr_path, img_path
+
+
+class ScanRecord(collections.namedtuple('ScanRecord',
+                                         'path name blend_path hdr_path thumb_path mtime size variants')):
+    """
+    One asset found by the scanner
+
+    size is the size of the blend (or HDR) file, variants the VARIANT_* flags of
+    the blend files found in the asset folder.
+    """
+    __slots__ = ()
+
+
+def scan_asset_folder(entry, mtime):
+    """
+    Read one asset folder
+
+    :param entry: os.DirEntry of the asset folder
+    :param mtime: mtime of the asset folder
+    :return: ScanRecord, or None if the folder holds no asset
+    """
+    entries = list_dir(entry.path)
+    blend_path, hdr_path, img_path = classify_entries(entries)
+    # No preview found, if it's an HDRI than use that as the preview
+    thumb_path = img_path or hdr_path
+    if not thumb_path:
+        return None
+
+    size = variants = 0
+    for file_entry in entries:
+        if file_entry.path == (blend_path or hdr_path):
+            size = entry_size(file_entry)
+        if is_blend(file_entry.name):
+            variants |= blend_variant(file_entry.name)
+    return ScanRecord(entry.path, entry.name, blend_path, hdr_path, thumb_path, mtime, size, variants)
+
+
+def iter_assets_subcategory(directory, known=None, cancelled=None):
+    """
+    Yield the assets inside a sub category, one asset folder (or loose HDR file) at a time
+
+    :param directory: The path to the sub-category
+    :param known: ScanRecords of a previous scan of this sub-category by path. Asset folders
+        whose mtime didn't change since are reused instead of listed again
+    :param cancelled: threading.Event checked before each asset folder, ScanCancelled is
+        raised once it is set
+    :return: Iterator over ScanRecords, sorted by name
+    """
+    known = known or {}
+    for entry in list_dir(directory):
+        check_cancelled(cancelled)
+        if is_dir(entry):
+            # The item is a folder that contains either a blend file or an HDRI file
+            mtime = entry_mtime(entry)
+            if mtime is None:
+                continue
+            record = known.get(entry.path)
+            if record is None or record.mtime != mtime:
+                record = scan_asset_folder(entry, stable_mtime(mtime))
+            if record is not None:
+                yield record
+        elif is_hdr(entry.name):
+            # Handle loose .hdr file, its record only depends on the file name (and its size
+            # once it is fully copied)
+            record = known.get(entry.path)
+            if record is None or record.mtime == 0:
+                mtime = entry_mtime(entry)
+                if mtime is None:
+                    continue
+                record = ScanRecord(entry.path, entry.name, '', entry.path, entry.path, stable_mtime(mtime),
+                                    entry_size(entry), 0)
+            yield record
+
+
+def list_subfolders(directory):
+    """Paths of the folders inside directory, without the hidden ones, sorted by name"""
+    return [entry.path for entry in list_dir(directory) if is_dir(entry) and not entry.name.startswith('.')]
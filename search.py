@@ -0,0 +1,122 @@
+"""
+In-memory name search over the assets of a library.
+
+Names are indexed by trigram, so a query only checks the assets that share
+all its trigrams instead of every name of the library. Queries shorter than a
+trigram are answered from a sorted word list, matching word prefixes.
+filter_name() matches names the same way on a stream of records, for when the
+index isn't built yet.
+"""
+import bisect
+import collections
+import re
+
+_WORD_SPLIT = re.compile(r'[\W_]+')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def matches(query, *names):
+    """True if names contain every word of query, ignoring case, the way NameIndex.search() matches"""
+    text = '\0'.join(name.lower() for name in names)
+    words = None
+    for term in query.lower().split():
+        if len(term) < 3:
+            if words is None:
+                words = [word for word in _WORD_SPLIT.split(text) if word]
+            if not any(word.startswith(term) for word in words):
+                return False
+        elif term not in text:
+            return False
+    return True
+
+
+def filter_name(records, query, names):
+    """
+    Keep the records whose names match query, see matches()
+
+    :param names: Function giving the names a record is found by
+    """
+    return (record for record in records if matches(query, *names(record)))
+
+
+class NameIndex:
+    """
+    Trigram and word prefix index over the names of the assets
+
+    Each asset is added with one or more names and gets the next integer id,
+    search() returns the ids of the matching assets in the order they were added.
+    """
+
+    def __init__(self):
+        self._texts = []
+        self._grams = collections.defaultdict(set)
+        self._words = []
+        self._words_sorted = True
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add(self, *names):
+        """
+        Index an asset
+
+        :param names: Names the asset is found by, e.g. its folder and file names
+        :return: Id of the asset
+        """
+        asset_id = len(self._texts)
+        text = '\0'.join(name.lower() for name in names)
+        self._texts.append(text)
+        for gram in trigrams(text):
+            self._grams[gram].add(asset_id)
+        for word in _WORD_SPLIT.split(text):
+            if word:
+                self._words.append((word, asset_id))
+        self._words_sorted = False
+        return asset_id
+
+    def search(self, query):
+        """
+        Find the assets whose names contain every word of query, ignoring case
+
+        :param query: Text typed in the search field
+        :return: Sorted list of asset ids
+        """
+        terms = query.lower().split()
+        if not terms:
+            return []
+        found = None
+        # Longest terms first, they have the fewest candidates
+        for term in sorted(terms, key=len, reverse=True):
+            matches = self._search_term(term, found)
+            found = matches if found is None else found & matches
+            if not found:
+                return []
+        return sorted(found)
+
+    def _search_term(self, term, within):
+        if len(term) < 3:
+            return self._search_prefix(term)
+        candidates = None
+        for gram in sorted(trigrams(term), key=lambda gram: len(self._grams.get(gram, ()))):
+            ids = self._grams.get(gram)
+            if not ids:
+                return set()
+            candidates = set(ids) if candidates is None else candidates & ids
+        if within is not None:
+            candidates &= within
+        return {asset_id for asset_id in candidates if term in self._texts[asset_id]}
+
+    def _search_prefix(self, prefix):
+        if not self._words_sorted:
+            self._words.sort()
+            self._words_sorted = True
+        found = set()
+        for i in range(bisect.bisect_left(self._words, (prefix,)), len(self._words)):
+            word, asset_id = self._words[i]
+            if not word.startswith(prefix):
+                break
+            found.add(asset_id)
+        return found
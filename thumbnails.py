@@ -0,0 +1,281 @@
+"""
+On-disk cache of asset thumbnails downscaled to preview resolution.
+
+Vendor thumbnails are often 2-4K images, but the preview grid only shows small
+icons. Each source image is downscaled once and stored under a key made of its
+path, file size and mtime, so later loads decode a small file instead, and a
+changed source image gets a new cache entry.
+
+Decoding a full size image is far too slow for the main thread, so the
+downscaled copies are made by a background worker: images are shrunk with
+imbuf, Radiance .hdr files are decoded and tonemapped to a PNG with NumPy, and
+EXR files are shrunk to a small EXR. A copy that can't be made leaves a marker
+file next to where it would be, so the file isn't read again until it changes.
+"""
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import struct
+import threading
+import zlib
+
+import imbuf
+import numpy as np
+
+from .scanner import is_hdr
+
+# Largest side, in pixels, of the cached thumbnails
+THUMBNAIL_SIZE = 128
+
+
+class ThumbnailCache:
+    """
+    Folder of downscaled thumbnails
+
+    :param directory: Folder the downscaled thumbnails are stored in
+    :param size: Largest side of the downscaled thumbnails
+    :param fallback: Image shown for the HDR files whose proxy can't be made
+    """
+
+    def __init__(self, directory, size=THUMBNAIL_SIZE, fallback=None):
+        self.directory = directory
+        self.size = size
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._finished = []
+        self._failed = set()
+        self._executor = None
+
+    def key(self, path):
+        """
+        Key of the current content of an image, made of its path, file size and mtime
+
+        :param path: Path to the source image
+        :return: Key as a hex string, None if the image can't be read
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = "%s\0%d\0%d\0%d" % (os.path.normpath(path), stat.st_size, stat.st_mtime_ns, self.size)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def cache_path(self, path, key, ext=None):
+        """Path of the cached copy of path, for its content key"""
+        if ext is None:
+            ext = os.path.splitext(path)[1].lower()
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def get(self, path, key=None):
+        """
+        Get the file to load as preview for an image, downscaling it on first use
+
+        :param path: Path to the source image
+        :param key: Content key of the image if it is known already, see key()
+        :return: Path to the downscaled copy, None while it is being made in the background.
+            If it can't be made, path itself for an image and the fallback image (or path
+            without one) for an HDR file
+        """
+        if key is None:
+            key = self.key(path)
+            if key is None:
+                return path
+
+        if is_hdr(path):
+            ext = '.png' if path.lower().endswith(('.hdr', '.hdri')) else '.exr'
+            cached = self.cache_path(path, key, ext)
+        else:
+            cached = self.cache_path(path, key)
+        if os.path.exists(cached):
+            return cached
+        if cached in self._failed or os.path.exists(cached + '.failed'):
+            self._failed.add(cached)
+            if is_hdr(path):
+                return self.fallback or path
+            return path
+        return self.request_proxy(path, cached)
+
+    def downscale(self, path, cached):
+        try:
+            ibuf = imbuf.load(path)
+        except (OSError, ValueError):
+            return path
+
+        try:
+            # Write to a temporary file first so a half written thumbnail is never used
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            temp_path = cached + '.tmp' + os.path.splitext(cached)[1]
+
+            width, height = ibuf.size
+            if max(width, height) <= self.size:
+                # Small enough already, a local copy still saves reading it from the library
+                shutil.copyfile(path, temp_path)
+            else:
+                scale = self.size / max(width, height)
+                ibuf.resize((max(1, round(width * scale)), max(1, round(height * scale))), method='BILINEAR')
+                imbuf.write(ibuf, filepath=temp_path)
+            os.replace(temp_path, cached)
+        except (OSError, ValueError):
+            return path
+        finally:
+            ibuf.free()
+        return cached
+
+    def request_proxy(self, path, cached):
+        """Make the downscaled copy of an image in the background worker, unless it is already being made"""
+        with self._lock:
+            if path not in self._pending:
+                self._pending.add(path)
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                self._executor.submit(self._make_proxy, path, cached)
+        return None
+
+    def _make_proxy(self, path, cached):
+        try:
+            if path.lower().endswith(('.hdr', '.hdri')):
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+                temp_path = cached + '.tmp.png'
+                write_png(temp_path, tonemap(read_hdr(path, self.size)))
+                os.replace(temp_path, cached)
+            elif self.downscale(path, cached) != cached:
+                raise ValueError("can't be read")
+        except (OSError, ValueError, IndexError) as e:
+            print("Could not make a preview of %s: %s" % (path, e))
+            self._mark_failed(cached)
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+                self._finished.append(path)
+
+    def _mark_failed(self, cached):
+        with self._lock:
+            self._failed.add(cached)
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            open(cached + '.failed', 'wb').close()
+        except OSError:
+            pass
+
+    @property
+    def busy(self):
+        with self._lock:
+            return bool(self._pending)
+
+    def take_finished(self):
+        """Remove and return the images whose downscaled copy was made (or failed) since the last call"""
+        with self._lock:
+            finished = self._finished
+            self._finished = []
+        return finished
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def read_hdr(path, size):
+    """
+    Read a Radiance .hdr file at reduced resolution
+
+    Only every n-th scanline is decoded, so the whole file never has to be held as floats.
+
+    :param path: Path to the .hdr file
+    :param size: Largest side of the returned image, it is never upscaled
+    :return: float32 array of shape (height, width, 3), linear RGB
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    pos = 0
+    header = True
+    while True:
+        end = data.index(b'\n', pos)
+        line = data[pos:end].strip()
+        pos = end + 1
+        if header and not line:
+            header = False
+        elif header:
+            if line.startswith(b'FORMAT=') and line != b'FORMAT=32-bit_rle_rgbe':
+                raise ValueError("unsupported format %s" % line.decode('ascii', 'replace'))
+        else:
+            # Resolution line, only the standard top to bottom orientation is used by HDRI vendors
+            parts = line.split()
+            if len(parts) != 4 or parts[0] != b'-Y' or parts[2] != b'+X':
+                raise ValueError("unsupported orientation")
+            height, width = int(parts[1]), int(parts[3])
+            break
+
+    step = max(1, -(-max(width, height) // size))
+    rows = []
+    for y in range(height):
+        keep = y % step == 0
+        if 8 <= width < 0x8000 and data[pos:pos + 2] == b'\x02\x02' and (data[pos + 2] << 8 | data[pos + 3]) == width:
+            pos, row = _read_rle_scanline(data, pos + 4, width, keep)
+        else:
+            row = np.frombuffer(data, np.uint8, width * 4, pos).reshape(width, 4) if keep else None
+            pos += width * 4
+        if keep:
+            rows.append(row[::step])
+
+    rgbe = np.stack(rows)
+    exponent = rgbe[..., 3].astype(np.int32)
+    scale = np.where(exponent > 0, np.ldexp(1.0, exponent - 136), 0.0).astype(np.float32)
+    return (rgbe[..., :3] + 0.5).astype(np.float32) * scale[..., None]
+
+
+def _read_rle_scanline(data, pos, width, keep):
+    """Decode (or skip) one run length encoded scanline, return the position after it and the RGBE pixels"""
+    row = np.empty((4, width), np.uint8) if keep else None
+    for channel in range(4):
+        x = 0
+        while x < width:
+            count = data[pos]
+            if count == 0:
+                raise ValueError("corrupt scanline")
+            if count > 128:
+                count -= 128
+                if keep:
+                    row[channel, x:x + count] = data[pos + 1]
+                pos += 2
+            else:
+                if keep:
+                    row[channel, x:x + count] = np.frombuffer(data, np.uint8, count, pos + 1)
+                pos += 1 + count
+            x += count
+    return pos, row.T if keep else None
+
+
+def tonemap(rgb):
+    """
+    Tonemap linear HDR pixels for display
+
+    Exposure is normalised on the log-average luminance, then a Reinhard curve and
+    the sRGB gamma are applied.
+
+    :param rgb: float array of shape (height, width, 3)
+    :return: uint8 array of the same shape
+    """
+    luminance = rgb @ np.array([0.2126, 0.7152, 0.0722], np.float32)
+    key = np.exp(np.mean(np.log(luminance + 1e-4)))
+    rgb = rgb * (0.18 / max(key, 1e-4))
+    rgb = rgb / (1.0 + rgb)
+    return (np.clip(rgb, 0.0, 1.0) ** (1 / 2.2) * 255 + 0.5).astype(np.uint8)
+
+
+def write_png(path, pixels):
+    """Write an 8 bit RGB image, as a (height, width, 3) uint8 array, to a PNG file"""
+    height, width, _ = pixels.shape
+    raw = b''.join(b'\x00' + row.tobytes() for row in np.ascontiguousarray(pixels))
+
+    def chunk(tag, body):
+        return struct.pack('>I', len(body)) + tag + body + struct.pack('>I', zlib.crc32(tag + body) & 0xffffffff)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw)))
+        f.write(chunk(b'IEND', b''))